@@ -278,7 +278,8 @@ print()
 
 # For some calls you will want caching. To facilitate this, a customized
 # cache handler can be attached. Below is an example of a simple cache
-# handler.
+# handler. For real applications, eveapi comes with ready-made handlers such
+# as eveapi.MemoryCacheHandler.
 
 
 class MyCacheHandler(object):
@@ -438,7 +439,18 @@ print("{} sales yielded {:,.2f} ISK since {}".format(
     time.asctime(time.gmtime(date)),
 ))
 
-# I'll leave walking the transaction pages as an excercise to the reader ;)
+# The API only returns the most recent transactions in one call. A Pager
+# walks back through the older pages, and can request the next page while
+# you are still busy with the current one.
+pager = me.WalletTransactions.pages(prefetch=True)
+for page in pager:
+    print("Got a page of {} transactions".format(len(page)))
+
+# Or merge all pages into one rowset. Passing the highest ID of a previous
+# walk as stopID only fetches the transactions that were made since.
+allTx = me.WalletTransactions.pages(stopID=pager.highestID).collect()
+print("{} new transactions".format(len(allTx)))
+
 # Please also see the eveapi module itself for more documentation.
 
 # That's all folks!
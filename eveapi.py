@@ -26,6 +26,68 @@
 #
 #-----------------------------------------------------------------------------
 #
+# Version: 1.4.0 - unreleased
+# - HTTP connections are now kept alive and reused through a per-host
+#   connection pool owned by the EVEAPIConnection. See the poolSize and
+#   poolTimeout arguments.
+# - Added the eveapi_async module, providing AsyncEVEAPIConnection for use
+#   with asyncio (Python 3.5+).
+# - Added batch() method to contexts, which performs many API calls
+#   concurrently on a bounded number of worker threads.
+# - Added MemoryCacheHandler, a thread-safe bounded in-memory cache handler.
+# - Added TieredCacheHandler, which keeps parsed objects in memory and the
+#   compressed XML documents on disk, so cache hits don't need parsing.
+# - Identical requests made concurrently are now coalesced into a single
+#   request to the server (see the coalesce argument of EVEAPIConnection).
+# - Added SQLiteCacheHandler, a persistent cache handler that can be shared
+#   by multiple processes.
+# - Added staleWhileRevalidate and staleIfError policies to EVEAPIConnection,
+#   using the new optional retrieve_stale() cache handler method.
+# - Added RefreshScheduler, which re-fetches registered calls shortly after
+#   their cachedUntil time.
+# - Added RateLimiter, a token bucket limiter for requests per host and per
+#   API key (see the rateLimiter argument of EVEAPIConnection).
+# - Faster parsing of rowsets: column types are determined from the first
+#   row of a rowset and subsequent rows are cast using per-column casters.
+#   Dates are no longer parsed with strptime().
+# - Added SchemaRegistry. Rowset columns of the common endpoints are now cast
+#   to the types registered in eveapi.schemas instead of guessed ones, and
+#   strict mode raises SchemaError when a response doesn't match its schema.
+# - Added iter_rows() function and stream() method to contexts, which yield
+#   the rows of a rowset while the document is being parsed.
+# - API responses are now parsed while they are being received, also when a
+#   cache handler is used.
+# - Added lazy parsing mode (see the lazy argument of EVEAPIConnection and
+#   ParseXML), which only parses the parts of a result that are accessed.
+# - Row objects no longer have a __dict__ and look up columns by name in a
+#   dict shared by all rows of a rowset, instead of searching the columns.
+#   Rows can now be iterated over to get their values.
+# - Added ColumnarRowset and ColumnarIndexRowset, which store rowset data in
+#   typed arrays and dictionary-encoded columns. Rowsets can be converted
+#   using their new ToColumnar() method.
+# - Added ToNumpy(), ToStructured() and ToArrow() methods to rowsets. For
+#   columnar rowsets, numeric columns are exported without copying.
+# - Added Where(), Count(), Sum(), Min(), Max() and Mean() methods to
+#   rowsets. On columnar rowsets these are vectorized with NumPy if it is
+#   available.
+# - Added named indexes to rowsets (see AddIndex(), Lookup() and Range()),
+#   which are built on first use and kept up to date as rows are appended.
+# - Added Pager, which walks the pages of journal type API functions such as
+#   WalletJournal and WalletTransactions (see also the pages() method of
+#   contexts), optionally prefetching the next page.
+# - Added DeltaSync, which keeps the highest journal/transaction IDs and the
+#   last AssetList in an SQLite database, so that each sync only fetches
+#   and returns the new or changed rows.
+# - Added Diff() and Changes() methods to IndexRowset, which compare two
+#   versions of a rowset by key, optionally ignoring some columns.
+# - Added PackResult(), UnpackResult(), SaveResult() and LoadResult(), which
+#   store results in a compact binary format that loads faster than pickles.
+# - Pickled IndexRowsets no longer contain their index, and pickling
+#   FilterRowsets works again.
+# - Added FreezeResult() and OpenFrozen(), which store a large result in a
+#   file that processes can open through a memory map, sharing its data
+#   instead of loading it (see FrozenIndexRowset).
+#
 # Version: 1.3.2 - 29 August 2015
 # - Added Python 3 support
 #
@@ -158,6 +220,7 @@ from past.builtins import cmp
 from future import standard_library
 standard_library.install_aliases()
 from past.builtins import basestring
+from past.builtins import long
 from builtins import map
 from builtins import zip
 from builtins import range
@@ -168,14 +231,38 @@ from urllib.parse import urlparse, urlencode
 # from urllib.request import urlopen, Request
 # from urllib.error import HTTPError
 
+from queue import Queue, Empty
+from collections import Counter, OrderedDict
+
+import array
+import bisect
 import copy
+import decimal
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import mmap
+import operator
+import os
+import random
+import re
+import sqlite3
+import struct
+import tempfile
+import socket
+import sys
+import threading
+import time
 import warnings
+import zlib
 
 from xml.parsers import expat
 from time import strptime
 from calendar import timegm
 
-__version__ = "1.3.2"
+__version__ = "1.4.0"
 _default_useragent = "eveapi.py/{}".format(__version__)
 _useragent = None  # use set_user_agent() to set this.
 
@@ -189,6 +276,8 @@ def set_cast_func(func):
 	The function must have 2 arguments; key and value. It should return a
 	value or object of the type appropriate for the given attribute name/key.
 	func may be None and will cause the default _autocast function to be used.
+	While a cast function is set, it is used instead of the column types of
+	the schemas registry (see SchemaRegistry).
 	"""
 	global _castfunc
 	_castfunc = _autocast if func is None else func
@@ -215,8 +304,13 @@ class AuthenticationError(Error):
 class ServerError(Error):
 	pass
 
+class SchemaError(RuntimeError):
+	# raised by the parser in strict mode when an API response does not
+	# match the schema registered for it (see SchemaRegistry).
+	pass
+
 
-def EVEAPIConnection(url="api.eveonline.com", cacheHandler=None, proxy=None, proxySSL=False):
+def EVEAPIConnection(url="api.eveonline.com", cacheHandler=None, proxy=None, proxySSL=False, poolSize=4, poolTimeout=30, coalesce=True, staleWhileRevalidate=False, staleIfError=False, rateLimiter=None, lazy=False):
 	# Creates an API object through which you can call remote functions.
 	#
 	# The following optional arguments may be provided:
@@ -228,6 +322,38 @@ def EVEAPIConnection(url="api.eveonline.com", cacheHandler=None, proxy=None, pro
 	#
 	# proxySSL - True if the proxy requires SSL, False otherwise.
 	#
+	# poolSize - maximum number of idle keep-alive connections kept around
+	#            per server for reuse by subsequent requests. All contexts
+	#            derived from this connection share the pool. 0 disables
+	#            connection reuse.
+	#
+	# poolTimeout - seconds an idle connection may sit in the pool before it
+	#               is discarded instead of reused.
+	#
+	# coalesce - if True, identical requests (same path and parameters) made
+	#            concurrently while the first one is still in flight do not
+	#            hit the server again, but wait for and share the result (or
+	#            exception) of the first. Note that this means such callers
+	#            receive the same result object.
+	#
+	# staleWhileRevalidate - if True, an expired document still available
+	#            from the cache handler (see retrieve_stale below) is
+	#            returned immediately, while a fresh copy is fetched into
+	#            the cache in the background.
+	#
+	# staleIfError - if True, an expired document still available from the
+	#            cache handler is returned when fetching a fresh copy fails
+	#            with a ServerError (including HTTP 5xx responses) or a
+	#            connection error.
+	#
+	# rateLimiter - a RateLimiter instance that will throttle the requests
+	#            sent to the API server. A single RateLimiter may be shared
+	#            by multiple connections (including asyncio ones) to enforce
+	#            a common limit.
+	#
+	# lazy - if True, the tags inside the result of API calls are only
+	#        parsed when they are first accessed (see ParseXML).
+	#
 	# cacheHandler - an object which must support the following interface:
 	#
 	#      retrieve(host, path, params)
@@ -253,39 +379,84 @@ def EVEAPIConnection(url="api.eveonline.com", cacheHandler=None, proxy=None, pro
 	#          will only be called if you returned None in the retrieve() for
 	#          this object.
 	#
+	#      retrieve_stale(host, path, params)  [optional]
+	#
+	#          Called by the staleWhileRevalidate and staleIfError policies
+	#          after retrieve() returned None. Same as retrieve(), except that
+	#          it should return the cached entry even if it has expired. The
+	#          built-in cache handlers implement this.
+	#
+
+	ctx = _NewRootContext(_RootContext, url, cacheHandler, proxy, proxySSL, rateLimiter)
+	ctx._pool = _ConnectionPool(poolSize, poolTimeout)
+	ctx._flights = _SingleFlight() if coalesce else None
+	ctx._staleWhileRevalidate = staleWhileRevalidate
+	ctx._staleIfError = staleIfError
+	ctx._revalidating = set()
+	ctx._revalidateLock = threading.Lock()
+	ctx._lazy = lazy
+	return ctx
+
 
+def _NewRootContext(cls, url, cacheHandler, proxy, proxySSL, rateLimiter):
+	# sets up a root context of the given class for the API server at url.
 	if not url.startswith("http"):
 		url = "https://" + url
 	p = urlparse(url, "https")
 	if p.path and p.path[-1] == "/":
 		p.path = p.path[:-1]
-	ctx = _RootContext(None, p.path, {}, {})
+	ctx = cls(None, p.path, {}, {})
 	ctx._handler = cacheHandler
 	ctx._scheme = p.scheme
 	ctx._host = p.netloc
 	ctx._proxy = proxy or globals()["proxy"]
 	ctx._proxySSL = proxySSL or globals()["proxySSL"]
+	ctx._limiter = rateLimiter
 	return ctx
 
 
-def ParseXML(file_or_string):
+def ParseXML(file_or_string, path=None, lazy=False):
+	# path is the API endpoint the document came from (e.g. "char/AssetList"),
+	# used to look up the schema of its rowsets (see SchemaRegistry).
+	#
+	# If lazy is True, the document is only scanned for the positions of
+	# the tags inside its result, and each of those is parsed when it is
+	# first accessed. Use this when only a few of them are needed. The
+	# document is scanned while it is read, but the result keeps the whole
+	# document in memory for as long as some of its tags are not parsed.
 	try:
-		return _ParseXML(file_or_string, False, None)
+		return _ParseXML(file_or_string, False, None, path, lazy)
 	except TypeError:
 		raise TypeError("XML data must be provided as string or file-like object")
 
 
-def _ParseXML(response, fromContext, storeFunc):
+def _ParseXML(response, fromContext, storeFunc, path=None, lazy=False):
 	# pre/post-process XML or Element data
+	parser = _LazyParser if lazy else _Parser
 	if fromContext and isinstance(response, Element):
 		obj = response
 	elif isinstance(response, basestring):
-		obj = _Parser().Parse(response, False)
+		obj = parser().Parse(response, False, path)
 	elif hasattr(response, "read"):
-		obj = _Parser().Parse(response, True)
+		obj = parser().Parse(response, True, path)
 	else:
 		raise TypeError("retrieve method must return None, string, file-like object or an Element instance")
 
+	result = _CheckResult(obj)
+
+	if fromContext and storeFunc:
+		# call the cache handler to store this object
+		storeFunc(obj)
+
+	# make metadata available to caller somehow
+	result._meta = obj
+
+	return result
+
+
+def _CheckResult(obj):
+	# raises the error reported by a parsed API document, if any, and
+	# returns the document's result element.
 	error = getattr(obj, "error", False)
 	if error:
 		if error.code >= 500:
@@ -300,18 +471,59 @@ def _ParseXML(response, fromContext, storeFunc):
 	result = getattr(obj, "result", False)
 	if not result:
 		raise RuntimeError("API object does not contain result")
+	return result
 
-	if fromContext and storeFunc:
-		# call the cache handler to store this object
-		storeFunc(obj)
 
-	# make metadata available to caller somehow
-	result._meta = obj
+def iter_rows(file_or_string, rowset=None, path=None, chunkSize=65536):
+	# Parses an API XML document incrementally, yielding the rows of the
+	# rowset named <rowset> as Row objects as soon as they have been parsed.
+	# If no rowset is given, the first rowset in the result is used. Rows
+	# are not kept after they have been yielded, so memory use does not
+	# depend on the size of the document. Nested rowsets of the same name
+	# (such as the contents of items in asset lists) are streamed as well.
+	#
+	# path is the API endpoint the document came from, used to look up the
+	# schema of the rowset (see SchemaRegistry). API errors reported by the
+	# document are raised once the whole document has been read.
+	if isinstance(file_or_string, bytes):
+		file_or_string = io.BytesIO(file_or_string)
+	elif isinstance(file_or_string, basestring):
+		file_or_string = io.StringIO(file_or_string)
+	elif not hasattr(file_or_string, "read"):
+		raise TypeError("XML data must be provided as string or file-like object")
+
+	p = _StreamParser(rowset)
+	parser = p.create(path)
+	while True:
+		chunk = file_or_string.read(chunkSize)
+		parser.Parse(chunk, not chunk)
+		if p.rows:
+			rows, p.rows = p.rows, []
+			for row in rows:
+				yield row
+		if not chunk:
+			break
+
+	if p.root is None:
+		raise RuntimeError("Invalid API response")
+	_CheckResult(p.root)
+
 
-	return result
 
 
 
+def _KeyID(kw):
+	# returns the API key a request is made with, if any.
+	return kw.get("keyID", kw.get("userID"))
+
+def _CheckStatus(path, status, reason):
+	# raises the appropriate exception for a non-200 HTTP response.
+	if status == http.client.NOT_FOUND:
+		raise AttributeError("'%s' not available on API server (404 Not Found)" % path)
+	elif status == http.client.FORBIDDEN:
+		raise AuthenticationError(status, 'HTTP 403 - Forbidden')
+	else:
+		raise ServerError(status, "'%s' request failed (%s)" % (path, reason))
 
 
 #-----------------------------------------------------------------------------
@@ -321,6 +533,166 @@ def _ParseXML(response, fromContext, storeFunc):
 _listtypes = (list, tuple, dict)
 _unspecified = []
 
+# errors for which the staleIfError policy serves an expired document.
+_serveStaleErrors = (ServerError, http.client.HTTPException, socket.error)
+
+# errors that indicate a pooled connection was closed by the server while
+# it sat idle. Requests failing this way on a reused connection are retried
+# once on a fresh connection.
+_staleErrors = (http.client.HTTPException, socket.error)
+
+
+class _ConnectionPool(object):
+	# Keeps idle keep-alive HTTP(S) connections around so that subsequent
+	# requests to the same server (or proxy) don't have to go through a full
+	# TCP and SSL handshake again.
+	#
+	# Connections are pooled per (ssl, address) pair, where address is either
+	# the "host[:port]" string of the API server or the (host, port) tuple of
+	# a proxy. At most <size> idle connections are kept per address, and
+	# connections that have been idle for more than <timeout> seconds are
+	# closed instead of reused. The pool is thread-safe.
+
+	def __init__(self, size=4, timeout=30):
+		self.size = size
+		self.timeout = timeout
+		self._idle = {}
+		self._lock = threading.Lock()
+
+	def _connect(self, key):
+		useSSL, address = key
+		cls = http.client.HTTPSConnection if useSSL else http.client.HTTPConnection
+		if isinstance(address, tuple):
+			return cls(*address)
+		return cls(address)
+
+	def _acquire(self, key):
+		# returns a (connection, reused) tuple.
+		expired = []
+		try:
+			with self._lock:
+				idle = self._idle.get(key)
+				now = time.time()
+				while idle:
+					conn, since = idle.pop()
+					if now - since < self.timeout:
+						return conn, True
+					expired.append(conn)
+		finally:
+			for conn in expired:
+				conn.close()
+		return self._connect(key), False
+
+	def request(self, key, method, url, body, headers):
+		# sends the request over a pooled connection if one is available,
+		# transparently reconnecting if that connection went stale.
+		# returns a (connection, response) tuple. The connection must be
+		# handed back with release() once the response has been read.
+		conn, reused = self._acquire(key)
+		while True:
+			try:
+				conn.request(method, url, body, headers)
+				return conn, conn.getresponse()
+			except _staleErrors:
+				conn.close()
+				if not reused:
+					raise
+			except:
+				conn.close()
+				raise
+			conn, reused = self._connect(key), False
+
+	def release(self, key, conn, response):
+		# connections can only be reused if the server didn't ask us to close
+		# it and the previous response was consumed entirely.
+		if self.size <= 0 or response.will_close or not response.isclosed():
+			conn.close()
+			return
+
+		with self._lock:
+			idle = self._idle.setdefault(key, [])
+			idle.append((conn, time.time()))
+			if len(idle) > self.size:
+				conn = idle.pop(0)[0]
+			else:
+				conn = None
+
+		if conn is not None:
+			conn.close()
+
+	def clear(self):
+		# closes all idle connections.
+		with self._lock:
+			idle, self._idle = self._idle, {}
+		for conns in idle.values():
+			for conn, since in conns:
+				conn.close()
+
+class _ResponseTee(object):
+	# file-like wrapper around a HTTP response that keeps the chunks read
+	# from it, so the document can be handed to the cache handler after it
+	# has been parsed without reading the response into memory first. Text
+	# read from other file-like objects is kept (and returned) UTF-8 encoded.
+	# The chunks are collected in a BytesIO, whose getvalue() hands out its
+	# buffer rather than a copy, so only one copy of the document is kept.
+
+	def __init__(self, response):
+		self._buffer = io.BytesIO()
+		self._response = response
+
+	def read(self, size=-1):
+		data = self._response.read(size) if size >= 0 else self._response.read()
+		if not isinstance(data, bytes):
+			data = data.encode("utf-8")
+		self._buffer.write(data)
+		return data
+
+	def getvalue(self):
+		return self._buffer.getvalue()
+
+
+class _Flight(object):
+	# a call in progress, as tracked by _SingleFlight.
+	def __init__(self):
+		self.event = threading.Event()
+		self.result = self.error = None
+
+
+class _SingleFlight(object):
+	# Coalesces identical calls made concurrently from multiple threads. The
+	# first caller for a given key performs the call, any other callers for
+	# that key wait for it to finish and receive the same result, or have the
+	# same exception raised.
+
+	def __init__(self):
+		self._calls = {}
+		self._lock = threading.Lock()
+
+	def do(self, key, func, *args):
+		with self._lock:
+			call = self._calls.get(key)
+			leader = call is None
+			if leader:
+				call = self._calls[key] = _Flight()
+
+		if not leader:
+			call.event.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result
+
+		try:
+			call.result = func(*args)
+			return call.result
+		except Exception as e:
+			call.error = e
+			raise
+		finally:
+			with self._lock:
+				del self._calls[key]
+			call.event.set()
+
+
 class _Context(object):
 
 	def __init__(self, root, path, parentDict, newKeywords=None):
@@ -361,6 +733,45 @@ class _Context(object):
 		# now let the root context handle it further
 		return self._root(self._path, **kw)
 
+	def stream(self, rowset=None, **kw):
+		# Performs the API call, yielding the rows of its result as they are
+		# received instead of returning the whole result (see iter_rows).
+		# Streamed calls bypass the cache handler.
+		self._root._requireBlocking("stream()")
+		for k, v in self.parameters.items():
+			if k not in kw:
+				kw[k] = v
+		return self._root._stream(self._path, rowset, kw)
+
+	def pages(self, **kw):
+		# Returns a Pager walking the pages of this journal type API function
+		# (see Pager). Contextual parameters are added by the calls.
+		return Pager(self, **kw)
+
+	def batch(self, calls, workers=8):
+		# Performs many API calls concurrently on at most <workers> threads
+		# and returns a list with the result of every call, in input order.
+		# Calls that failed are represented by the exception they raised.
+		#
+		# calls is a sequence of (path, params) tuples, where path is either
+		# the path of the API function relative to this context (such as
+		# "char/CharacterSheet") or a context object for it (such as
+		# auth.character(characterID).CharacterSheet), and params is a dict
+		# of extra parameters for the call or None.
+		#
+		# Calls that can be answered by the cache handler are handled right
+		# away; only cache misses are dispatched to the worker threads.
+		prepared = []
+		for path, params in calls:
+			if not isinstance(path, _Context):
+				path = _Context(self._root, self._path + "/" + path.strip("/"), self.parameters)
+			kw = path.parameters.copy()
+			if params:
+				kw.update(params)
+			prepared.append((path._path, kw))
+
+		return self._root._batch(prepared, workers)
+
 
 class _AuthContext(_Context):
 
@@ -388,74 +799,209 @@ class _RootContext(_Context):
 	def __bool__(self):
 		return True
 
-	def __call__(self, path, **kw):
+	def _requireBlocking(self, feature):
+		# raises TypeError if feature, which performs blocking calls, can't
+		# be used with this connection (see eveapi_async).
+		pass
+
+	def _prepare(self, path, kw):
 		# convert list type arguments to something the API likes
 		for k, v in kw.items():
 			if isinstance(v, _listtypes):
 				kw[k] = ','.join(map(str, list(v)))
+		return path + ".xml.aspx"
+
+	def _request(self, path, kw):
+		# returns the pool key, method, url, body and headers of the HTTP
+		# request for given API call.
+		if self._proxy is None:
+			req = path
+			key = (self._scheme == "https", self._host)
+		else:
+			req = self._scheme+'://'+self._host+path
+			key = (bool(self._proxySSL), tuple(self._proxy))
 
-		cache = self._root._handler
-
-		# now send the request
-		path += ".xml.aspx"
+		if kw:
+			return key, "POST", req, urlencode(kw), {"Content-type": "application/x-www-form-urlencoded", "User-Agent": _useragent or _default_useragent}
+		return key, "GET", req, "", {"User-Agent": _useragent or _default_useragent}
 
+	def _retrieve(self, path, kw):
+		cache = self._root._handler
 		if cache:
-			response = cache.retrieve(self._host, path, kw)
-		else:
-			response = None
+			return cache.retrieve(self._host, path, kw)
+		return None
 
+	def __call__(self, path, **kw):
+		path = self._prepare(path, kw)
+		response = self._retrieve(path, kw)
 		if response is None:
 			if not _useragent:
 				warnings.warn("No User-Agent set! Please use the set_user_agent() module-level function before accessing the EVE API.", stacklevel=3)
+			return self._fetch(path, kw)
 
-			if self._proxy is None:
-				req = path
-				if self._scheme == "https":
-					conn = http.client.HTTPSConnection(self._host)
-				else:
-					conn = http.client.HTTPConnection(self._host)
-			else:
-				req = self._scheme+'://'+self._host+path
-				if self._proxySSL:
-					conn = http.client.HTTPSConnection(*self._proxy)
-				else:
-					conn = http.client.HTTPConnection(*self._proxy)
+		return self._process(path, kw, response)
 
-			if kw:
-				conn.request("POST", req, urlencode(kw), {"Content-type": "application/x-www-form-urlencoded", "User-Agent": _useragent or _default_useragent})
-			else:
-				conn.request("GET", req, "", {"User-Agent": _useragent or _default_useragent})
+	def _stream(self, path, rowset, kw):
+		path = self._prepare(path, kw)
+		if not _useragent:
+			warnings.warn("No User-Agent set! Please use the set_user_agent() module-level function before accessing the EVE API.", stacklevel=3)
 
-			response = conn.getresponse()
+		limiter = self._root._limiter
+		if limiter:
+			limiter.acquire(self._host, _KeyID(kw))
+
+		key, method, req, body, headers = self._request(path, kw)
+		conn, response = self._pool.request(key, method, req, body, headers)
+		try:
 			if response.status != 200:
-				if response.status == http.client.NOT_FOUND:
-					raise AttributeError("'%s' not available on API server (404 Not Found)" % path)
-				elif response.status == http.client.FORBIDDEN:
-					raise AuthenticationError(response.status, 'HTTP 403 - Forbidden')
+				response.read()
+				_CheckStatus(path, response.status, response.reason)
+			for row in iter_rows(response, rowset, path):
+				yield row
+		finally:
+			# if the caller stopped early, the connection is closed by the
+			# pool as the response was not read entirely.
+			self._pool.release(key, conn, response)
+
+	def _fetch(self, path, kw):
+		# fetches a document the cache could not provide, falling back on
+		# the cache's expired copy of it where the stale policies allow.
+		root = self._root
+		stale = None
+		if root._staleWhileRevalidate or root._staleIfError:
+			retrieve_stale = getattr(root._handler, "retrieve_stale", None)
+			if retrieve_stale:
+				stale = retrieve_stale(self._host, path, kw)
+
+		if stale is not None and root._staleWhileRevalidate:
+			self._revalidate(path, kw)
+			return self._process(path, kw, stale)
+
+		try:
+			return self._coalesced(path, kw)
+		except _serveStaleErrors:
+			if stale is None:
+				raise
+		return self._process(path, kw, stale)
+
+	def _coalesced(self, path, kw):
+		# Identical requests that are already in flight are waited on rather
+		# than sent again.
+		flights = self._root._flights
+		if flights is None:
+			return self._process(path, kw, None)
+		return flights.do(_CacheKey(self._host, path, kw), self._process, path, kw, None)
+
+	def _revalidate(self, path, kw):
+		# refreshes the cached copy of a document in the background, unless
+		# that is already being done.
+		root = self._root
+		key = _CacheKey(self._host, path, kw)
+		with root._revalidateLock:
+			if key in root._revalidating:
+				return
+			root._revalidating.add(key)
+
+		def refresh():
+			try:
+				self._coalesced(path, kw)
+			except Exception:
+				pass
+			finally:
+				with root._revalidateLock:
+					root._revalidating.discard(key)
+
+		t = threading.Thread(target=refresh)
+		t.daemon = True
+		t.start()
+
+	def _batch(self, calls, workers):
+		results = [None] * len(calls)
+		pending = Queue()
+
+		for i, (path, kw) in enumerate(calls):
+			try:
+				path = self._prepare(path, kw)
+				response = self._retrieve(path, kw)
+				if response is None:
+					pending.put((i, path, kw))
 				else:
-					raise ServerError(response.status, "'%s' request failed (%s)" % (path, response.reason))
+					results[i] = self._process(path, kw, response)
+			except Exception as e:
+				results[i] = e
+
+		def worker():
+			while True:
+				try:
+					i, path, kw = pending.get_nowait()
+				except Empty:
+					return
+				try:
+					results[i] = self._fetch(path, kw)
+				except Exception as e:
+					results[i] = e
+
+		if not pending.empty():
+			if not _useragent:
+				warnings.warn("No User-Agent set! Please use the set_user_agent() module-level function before accessing the EVE API.", stacklevel=3)
 
-			if cache:
-				store = True
-				response = response.read()
-			else:
-				store = False
+			threads = [threading.Thread(target=worker) for i in range(min(workers, pending.qsize()))]
+			for t in threads:
+				t.daemon = True
+				t.start()
+			for t in threads:
+				t.join()
+
+		return results
+
+	def _process(self, path, kw, response):
+		# fetches the document if the cache did not provide one (response is
+		# None), then parses it.
+		cache = self._root._handler
+
+		conn = None
+		if response is None:
+			limiter = self._root._limiter
+			if limiter:
+				limiter.acquire(self._host, _KeyID(kw))
+
+			key, method, req, body, headers = self._request(path, kw)
+			conn, response = self._pool.request(key, method, req, body, headers)
+
+			httpResponse = response
+			if response.status != 200:
+				# drain the error page so the connection can be reused.
+				response.read()
+				self._pool.release(key, conn, response)
+				_CheckStatus(path, response.status, response.reason)
+
+			# the response is parsed straight from the socket, so the
+			# connection can only be released after parsing. If there is a
+			# cache handler, the data read is recorded for its store().
+			store = bool(cache)
+			if store:
+				response = _ResponseTee(response)
 		else:
 			store = False
 
-		retrieve_fallback = cache and getattr(cache, "retrieve_fallback", False)
-		if retrieve_fallback:
-			# implementor is handling fallbacks...
-			try:
-				return _ParseXML(response, True, store and (lambda obj: cache.store(self._host, path, kw, response, obj)))
-			except Error as e:
-				response = retrieve_fallback(self._host, path, kw, reason=e)
-				if response is not None:
-					return response
-				raise
-		else:
-			# implementor is not handling fallbacks...
-			return _ParseXML(response, True, store and (lambda obj: cache.store(self._host, path, kw, response, obj)))
+		storeFunc = store and (lambda obj: cache.store(self._host, path, kw, response.getvalue(), obj))
+		try:
+			retrieve_fallback = cache and getattr(cache, "retrieve_fallback", False)
+			if retrieve_fallback:
+				# implementor is handling fallbacks...
+				try:
+					return _ParseXML(response, True, storeFunc, path, self._root._lazy)
+				except Error as e:
+					response = retrieve_fallback(self._host, path, kw, reason=e)
+					if response is not None:
+						return response
+					raise
+			else:
+				# implementor is not handling fallbacks...
+				return _ParseXML(response, True, storeFunc, path, self._root._lazy)
+		finally:
+			if conn is not None:
+				self._pool.release(key, conn, httpResponse)
 
 #-----------------------------------------------------------------------------
 # XML Parser
@@ -476,6 +1022,9 @@ def _autocast(key, value):
 
 	if len(value) == 19 and value[10] == ' ':
 		# it could be a date string
+		t = _parsedate(value)
+		if t is not None:
+			return t
 		try:
 			return max(0, int(timegm(strptime(value, "%Y-%m-%d %H:%M:%S"))))
 		except OverflowError:
@@ -489,11 +1038,264 @@ def _autocast(key, value):
 _castfunc = _autocast
 
 
+_datere = re.compile("([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})$")
+_monthdays = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+_epochdays = {}  # "YYYY-MM-DD" -> days since epoch, for dates seen recently
+
+def _parsedate(value):
+	# fast equivalent of max(0, timegm(strptime(value, "%Y-%m-%d %H:%M:%S")))
+	# for well-formed dates. Returns None for anything else, in which case
+	# the caller should fall back on strptime.
+	m = _datere.match(value)
+	if m is None:
+		return None
+	y, mo, d, h, mi, s = map(int, m.groups())
+	if h > 23 or mi > 59 or s > 61:
+		return None
+
+	days = _epochdays.get(value[:10])
+	if days is None:
+		if not (1 <= mo <= 12 and 1 <= d) or y == 0:
+			return None
+		leap = (y % 4 == 0) and (y % 100 != 0 or y % 400 == 0)
+		if d > _monthdays[mo] + (leap and mo == 2):
+			return None
+
+		# days since the epoch, see http://howardhinnant.github.io/date_algorithms.html
+		if mo <= 2:
+			y -= 1
+		era = y // 400
+		yoe = y - era * 400
+		doy = (153 * (mo + (-3 if mo > 2 else 9)) + 2) // 5 + d - 1
+		days = era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+		if len(_epochdays) > 10000:
+			_epochdays.clear()
+		_epochdays[value[:10]] = days
+
+	return max(0, days * 86400 + h * 3600 + mi * 60 + s)
+
+
+# The following casters are used by the parser for rowset columns, once the
+# first row of a rowset has shown what type of data a column holds. Each
+# caster handles values of its type quickly and hands anything else to
+# _autocast, so the end result is always the same as with _autocast alone.
+
+def _castint(value):
+	if value.isdigit() or (value[:1] == "-" and value[1:].isdigit()):
+		try:
+			return int(value)
+		except ValueError:
+			pass
+	return _autocast(None, value)
+
+def _castfloat(value):
+	if "." in value:
+		try:
+			return float(value)
+		except ValueError:
+			pass
+	return _autocast(None, value)
+
+def _castdate(value):
+	if len(value) == 19 and value[10] == ' ':
+		t = _parsedate(value)
+		if t is not None:
+			return t
+	return _autocast(None, value)
+
+def _caststr(value):
+	# only strings starting with something that could make them a number
+	# (or date) need a closer look.
+	c = value[:1]
+	if not c or not (c in "+-.iInN" or c.isdigit() or c.isspace()):
+		return value
+	return _autocast(None, value)
+
+def _castplan(values):
+	# returns the casters for a row of values, guessing from the values.
+	plan = []
+	for value in values:
+		v = _autocast(None, value)
+		if type(v) is float:
+			plan.append(_castfloat)
+		elif type(v) is int:
+			plan.append(_castdate if value[10:11] == ' ' else _castint)
+		else:
+			plan.append(_caststr)
+	return plan
+
+
+def _schemadate(value):
+	# strict date caster for schemas.
+	t = _parsedate(value)
+	if t is None:
+		raise ValueError("not a date: %r" % (value,))
+	return t
+
+def _schemastr(value):
+	return value
+
+
+class SchemaRegistry(object):
+	# Maps API endpoints and the rowsets they return to column types, so
+	# the parser can cast values without guessing their type.
+	#
+	# A schema is registered for a rowset of one or more endpoints, given as
+	# "group/Name" like in the API paths:
+	#
+	#   registry.register("char/KillLog", "kills", killID="int", killTime="date")
+	#
+	# Column types are "int", "float", "isk", "date", "str" or a callable
+	# taking the string value. ISK amounts are cast to iskType, which is
+	# float by default and can be set to decimal.Decimal for exact amounts.
+	# Empty values are left as empty strings, and columns that are not in
+	# the schema have their type guessed as usual.
+	#
+	# A value that cannot be cast to the type of its column is cast as if
+	# the column had no schema. In strict mode, the parser instead raises
+	# SchemaError for such values and for columns that are not in the
+	# schema, so changes to the API are noticed.
+	#
+	# The module-level "schemas" registry is used for all API calls, and for
+	# ParseXML() if it is given the path of the document. It comes with the
+	# schemas of the common char, corp, eve, map and account endpoints.
+	#
+	# A cast function set with set_cast_func() takes precedence: while one
+	# is set, it is used for all values and schemas are not applied.
+
+	_types = {"int": int, "float": float, "date": _schemadate}
+
+	def __init__(self, strict=False, iskType=float):
+		self.strict = strict
+		self.iskType = iskType
+		self._endpoints = {}
+
+	def endpoint(self, path):
+		# returns the "group/Name" endpoint of an API path.
+		if path.endswith(".xml.aspx"):
+			path = path[:-9]
+		return "/".join(path.strip("/").split("/")[-2:])
+
+	def register(self, endpoints, rowset, **columns):
+		if isinstance(endpoints, basestring):
+			endpoints = [endpoints]
+		for endpoint in endpoints:
+			endpoint = self.endpoint(endpoint)
+			schema = self._endpoints.setdefault(endpoint, {}).setdefault(rowset, {})
+			for column, kind in columns.items():
+				schema[column] = self._caster(endpoint, rowset, column, kind)
+
+	def unregister(self, endpoint, rowset=None):
+		# removes the schema of a rowset, or of all rowsets of an endpoint.
+		endpoint = self.endpoint(endpoint)
+		if rowset is None:
+			self._endpoints.pop(endpoint, None)
+		else:
+			self._endpoints.get(endpoint, {}).pop(rowset, None)
+
+	def lookup(self, path):
+		# returns the schemas for the rowsets returned by an endpoint, as a
+		# dict of rowset name -> {column: caster}, or None.
+		return self._endpoints.get(self.endpoint(path))
+
+	def clear(self):
+		self._endpoints.clear()
+
+	def _caster(self, endpoint, rowset, column, kind):
+		if kind == "str":
+			return _schemastr
+		convert = self._types.get(kind, kind)
+		if not (kind == "isk" or callable(convert)):
+			raise ValueError("unknown column type %r for column '%s'" % (kind, column))
+		typename = getattr(kind, "__name__", kind)
+
+		def drift(value):
+			if self.strict:
+				raise SchemaError("%s: value %r of column '%s' in rowset '%s' is not of type %s" % (endpoint, value, column, rowset, typename))
+			return _castfunc(column, value)
+
+		if kind == "isk":
+			# iskType is looked up on every call, so it can be changed later.
+			def cast(value):
+				if value:
+					try:
+						return self.iskType(value)
+					except (ValueError, TypeError, ArithmeticError):
+						# (decimal.InvalidOperation is an ArithmeticError)
+						return drift(value)
+				return value
+		else:
+			def cast(value):
+				if value:
+					try:
+						return convert(value)
+					except (ValueError, TypeError):
+						return drift(value)
+				return value
+		return cast
+
+
+schemas = SchemaRegistry()
+
+# schemas of the common endpoints: (endpoints, rowset, "column:type ...")
+_defaultSchemas = [
+	("account/Characters", "characters", "name:str characterID:int corporationName:str corporationID:int allianceID:int allianceName:str factionID:int factionName:str"),
+	("char/AccountBalance corp/AccountBalance", "accounts", "accountID:int accountKey:int balance:isk"),
+	("char/AssetList corp/AssetList", "assets", "itemID:int locationID:int typeID:int quantity:int flag:int singleton:int rawQuantity:int"),
+	("char/AssetList corp/AssetList", "contents", "itemID:int typeID:int quantity:int flag:int singleton:int rawQuantity:int"),
+	("char/CharacterSheet", "skills", "typeID:int skillpoints:int level:int published:int"),
+	("char/CharacterSheet", "corporationRoles", "roleID:int roleName:str"),
+	("char/ContactList corp/ContactList", "contactList", "contactID:int contactName:str standing:float contactTypeID:int labelMask:int inWatchlist:str"),
+	("char/MarketOrders corp/MarketOrders", "orders", "orderID:int charID:int stationID:int volEntered:int volRemaining:int minVolume:int orderState:int typeID:int range:int accountKey:int duration:int escrow:isk price:isk bid:int issued:date"),
+	("char/SkillQueue", "skillqueue", "queuePosition:int typeID:int level:int startSP:int endSP:int startTime:date endTime:date"),
+	("char/WalletJournal corp/WalletJournal", "entries", "date:date refID:int refTypeID:int ownerName1:str ownerID1:int ownerName2:str ownerID2:int argName1:str argID1:int amount:isk balance:isk reason:str taxReceiverID:int taxAmount:isk owner1TypeID:int owner2TypeID:int"),
+	("char/WalletTransactions corp/WalletTransactions", "transactions", "transactionDateTime:date transactionID:int quantity:int typeName:str typeID:int price:isk clientID:int clientName:str characterID:int characterName:str stationID:int stationName:str transactionType:str transactionFor:str journalTransactionID:int clientTypeID:int"),
+	("corp/CorporationSheet", "divisions", "accountKey:int description:str"),
+	("corp/CorporationSheet", "walletDivisions", "accountKey:int description:str"),
+	("corp/MemberTracking", "members", "characterID:int name:str startDateTime:date baseID:int base:str title:str logonDateTime:date logoffDateTime:date locationID:int location:str shipTypeID:int shipType:str roles:int grantableRoles:int"),
+	("eve/AllianceList", "alliances", "name:str shortName:str allianceID:int executorCorpID:int memberCount:int startDate:date"),
+	("eve/AllianceList", "memberCorporations", "corporationID:int startDate:date"),
+	("eve/CharacterID eve/CharacterName", "characters", "name:str characterID:int"),
+	("eve/ConquerableStationList", "outposts", "stationID:int stationName:str stationTypeID:int solarSystemID:int corporationID:int corporationName:str x:float y:float z:float"),
+	("eve/ErrorList", "errors", "errorCode:int errorText:str"),
+	("eve/RefTypes", "refTypes", "refTypeID:int refTypeName:str"),
+	("map/FacWarSystems", "solarSystems", "solarSystemID:int solarSystemName:str occupyingFactionID:int occupyingFactionName:str owningFactionID:int owningFactionName:str contested:str victoryPoints:int victoryPointThreshold:int"),
+	("map/Jumps", "solarSystems", "solarSystemID:int shipJumps:int"),
+	("map/Kills", "solarSystems", "solarSystemID:int shipKills:int factionKills:int podKills:int"),
+	("map/Sovereignty", "solarSystems", "solarSystemID:int allianceID:int factionID:int solarSystemName:str corporationID:int"),
+]
+
+for _endpoints, _rowset, _columns in _defaultSchemas:
+	schemas.register(_endpoints.split(), _rowset, **dict(column.split(":") for column in _columns.split()))
+del _endpoints, _rowset, _columns
+
+
 class _Parser(object):
 
-	def Parse(self, data, isStream=False):
+	def Parse(self, data, isStream=False, path=None):
+		p = self.create(path)
+		if isStream:
+			# the document is fed to expat as it comes in, so parsing a HTTP
+			# response overlaps with receiving it. This uses read() rather
+			# than read1(), as only read() lets a HTTP response close itself
+			# at the end of the body, which the connection pool relies on.
+			while True:
+				chunk = data.read(65536)
+				p.Parse(chunk, not chunk)
+				if not chunk:
+					break
+		else:
+			p.Parse(data, True)
+		return self.root
+
+	def create(self, path=None):
+		# returns an expat parser that builds the document into self.root.
 		self.container = self.root = None
 		self._cdata = False
+		self._plans = {}
+		self._path = path
+		self._registry = schemas
+		self._schema = path and schemas and schemas.lookup(path)
 		p = expat.ParserCreate()
 		p.StartElementHandler = self.tag_start
 		p.CharacterDataHandler = self.tag_cdata
@@ -502,12 +1304,7 @@ class _Parser(object):
 		p.EndElementHandler = self.tag_end
 		p.ordered_attributes = True
 		p.buffer_text = True
-
-		if isStream:
-			p.ParseFile(data)
-		else:
-			p.Parse(data, True)
-		return self.root
+		return p
 
 
 	def tag_cdatasection_enter(self):
@@ -594,7 +1391,7 @@ class _Parser(object):
 				if not self.container._cols or (numAttr > numCols):
 					# the row data contains more attributes than were defined.
 					self.container._cols = attributes[0::2]
-				self.container.append([_castfunc(attributes[i], attributes[i+1]) for i in range(0, len(attributes), 2)])
+				self.container.append(self.castrow(self.container, attributes))
 			# </hack>
 
 			this._isrow = True
@@ -607,6 +1404,41 @@ class _Parser(object):
 		self.container = self._last = this
 		self.has_cdata = False
 
+	def castrow(self, rowset, attributes):
+		# casts the attribute values of a row tag. A cast plan is made for
+		# every rowset from its first row, and reused for subsequent rows
+		# that have the same attributes.
+		names = attributes[0::2]
+		values = attributes[1::2]
+		plan = self._plans.get(id(rowset))
+		if plan is None or plan[0] != names:
+			plan = self._plans[id(rowset)] = (names, self.castplan(rowset._name, names, values))
+		return [cast(value) for cast, value in zip(plan[1], values)]
+
+	def castplan(self, rowset, names, values):
+		# returns the casters for the columns of a rowset. A custom cast
+		# function is used for all columns if set. Otherwise columns typed
+		# by the schema of the endpoint use the schema's casters, and the
+		# types of other columns are guessed from the values (see _castplan).
+		if _castfunc is not _autocast:
+			return [functools.partial(_castfunc, name) for name in names]
+		schema = self._schema and self._schema.get(rowset)
+		if schema is None:
+			return _castplan(values)
+
+		plan = []
+		guessed = None
+		for i, name in enumerate(names):
+			cast = schema.get(name)
+			if cast is None:
+				if self._registry.strict:
+					raise SchemaError("%s: column '%s' of rowset '%s' is not in the schema" % (self._registry.endpoint(self._path), name, rowset))
+				if guessed is None:
+					guessed = _castplan(values)
+				cast = guessed[i]
+			plan.append(cast)
+		return plan
+
 	def tag_cdata(self, data):
 		self.has_cdata = True
 		if self._cdata:
@@ -724,6 +1556,116 @@ class _Parser(object):
 		return
 
 
+class _LazyParser(_Parser):
+	# parser for lazy mode. Builds the document like _Parser, except for
+	# the tags inside the result element, of which only the positions are
+	# recorded. The result becomes a _LazyElement that parses them later.
+
+	def Parse(self, data, isStream=False, path=None):
+		text = False
+		if isStream:
+			# streams are scanned as they are read, like _Parser does, and
+			# collected to parse the tags inside the result from later.
+			data = _ResponseTee(data)
+			_Parser.Parse(self, data, True, path)
+			data = data.getvalue()
+		else:
+			text = not isinstance(data, bytes)
+			if text:
+				# expat reports positions in the UTF-8 encoded document.
+				data = data.encode("utf-8")
+			_Parser.Parse(self, data, False, path)
+
+		result = self._result
+		if result is not None and self._lazy:
+			result._lazy = self._lazy
+			result._lazydoc = (data, self._head, self._tail, path, text)
+		return self.root
+
+	def create(self, path=None):
+		p = self._expat = _Parser.create(self, path)
+		self._skip = 0
+		self._result = None
+		self._lazy = {}
+		self._open = None
+		self._head = self._tail = None
+		return p
+
+	def close(self, index):
+		# ends the slice of the last tag found inside the result.
+		if self._open:
+			name, start = self._open
+			self._lazy.setdefault(name, []).append((start, index))
+			self._open = None
+
+	def tag_start(self, name, attributes):
+		if self._skip:
+			self._skip += 1
+			return
+
+		parent = self.container
+		if parent is not None and parent is self._result:
+			index = self._expat.CurrentByteIndex
+			self.close(index)
+			if self._head is None:
+				self._head = index
+			if name == "rowset":
+				name = attributes[attributes.index('name')+1]
+			elif ":" in name:
+				name = name[:name.index(":")]
+			self._open = (name, index)
+			self._skip = 1
+			self._last = None
+			# nothing but the end of this tag matters now.
+			p = self._expat
+			p.CharacterDataHandler = p.StartCdataSectionHandler = p.EndCdataSectionHandler = None
+			return
+
+		_Parser.tag_start(self, name, attributes)
+		if name == "result" and parent is not None and parent is self.root and self._result is None:
+			self._result = self.container
+			self._result.__class__ = _LazyElement
+
+	def tag_end(self, name):
+		if self._skip:
+			self._skip -= 1
+			if not self._skip:
+				p = self._expat
+				p.CharacterDataHandler = self.tag_cdata
+				p.StartCdataSectionHandler = self.tag_cdatasection_enter
+				p.EndCdataSectionHandler = self.tag_cdatasection_exit
+			return
+		if self.container is self._result and self._tail is None:
+			self._tail = self._expat.CurrentByteIndex
+			self.close(self._tail)
+		_Parser.tag_end(self, name)
+
+
+
+class _StreamParser(_Parser):
+	# parser used by iter_rows(). The rows of the streamed rowset are taken
+	# out of it and collected in self.rows as soon as they are complete.
+
+	def __init__(self, rowset=None):
+		self.rowset = rowset
+		self.rows = []
+
+	def tag_start(self, name, attributes):
+		parent = self.container
+		_Parser.tag_start(self, name, attributes)
+		if self.rowset is None and name == "rowset" and parent is not None and parent._name == "result":
+			self.rowset = self.container._name
+
+	def tag_end(self, name):
+		this = self.container
+		_Parser.tag_end(self, name)
+		rowset = self.container
+		if this._isrow and rowset._name == self.rowset and isinstance(rowset, Rowset):
+			self.rows.append(rowset._rowclass()(rowset._cols, rowset._rows.pop()))
+			if isinstance(rowset, IndexRowset):
+				rowset._items.clear()
+
+
 
 
 #-----------------------------------------------------------------------------
@@ -741,6 +1683,29 @@ class Element(object):
 	def __str__(self):
 		return "<Element '%s'>" % self._name
 
+
+class _LazyElement(Element):
+	# The result element of a document parsed in lazy mode. The tags inside
+	# it are parsed when they are first accessed, from the slices of the
+	# document located by _LazyParser. Each slice is parsed with the rest
+	# of the document around it, so that the usual rules apply.
+
+	def __getattr__(self, attr):
+		lazy = self.__dict__.get("_lazy")
+		if not lazy or attr not in lazy:
+			raise AttributeError(attr)
+
+		doc, head, tail, path, text = self._lazydoc
+		data = doc[:head] + b"".join([doc[start:end] for start, end in lazy[attr]]) + doc[tail:]
+		if text:
+			data = data.decode("utf-8")
+		value = getattr(_Parser().Parse(data, False, path).result, attr)
+
+		# another thread may have beaten us to it, first one wins.
+		value = self.__dict__.setdefault(attr, value)
+		lazy.pop(attr, None)
+		return value
+
 _fmt = u"%s:%s".__mod__
 class Row(object):
 	# A Row is a single database record associated with a Rowset.
@@ -748,12 +1713,23 @@ class Row(object):
 	# column name.
 	#
 	# To conserve resources, Row objects are only created on-demand. This is
-	# typically done by Rowsets (e.g. when iterating over the rowset).
+	# typically done by Rowsets (e.g. when iterating over the rowset), which
+	# use a subclass of Row made for their column layout (see _RowClass).
+
+	__slots__ = ("_cols", "_row")
+
+	_index = None  # column name -> position, set on the _RowClass classes.
 
 	def __init__(self, cols=None, row=None):
 		self._cols = cols or []
 		self._row = row or []
 
+	def _positions(self):
+		index = self._index
+		if index is None:
+			index = _RowClass(self._cols)._index
+		return index
+
 	def __bool__(self):
 		return True
 
@@ -764,35 +1740,89 @@ class Row(object):
 		return self.__cmp__(other) == 0
 
 	def __cmp__(self, other):
-		if type(other) != type(self):
+		if not isinstance(other, Row):
 			raise TypeError("Incompatible comparison type")
 		return cmp(self._cols, other._cols) or cmp(self._row, other._row)
 
 	def __hasattr__(self, this):
-		if this in self._cols:
-			return self._cols.index(this) < len(self._row)
-		return False
+		i = self._positions().get(this)
+		return i is not None and i < len(self._row)
 
 	__contains__ = __hasattr__
 
 	def get(self, this, default=None):
-		if (this in self._cols) and (self._cols.index(this) < len(self._row)):
-			return self._row[self._cols.index(this)]
+		i = self._positions().get(this)
+		if i is not None and i < len(self._row):
+			return self._row[i]
 		return default
 
 	def __getattr__(self, this):
+		if this in Row.__slots__:
+			# not initialized (yet).
+			raise AttributeError(this)
 		try:
-			return self._row[self._cols.index(this)]
-		except:
+			return self._row[self._positions()[this]]
+		except (KeyError, IndexError):
 			raise AttributeError(this)
 
 	def __getitem__(self, this):
-		return self._row[self._cols.index(this)]
+		try:
+			i = self._positions()[this]
+		except KeyError:
+			raise ValueError("%r is not a column" % (this,))
+		return self._row[i]
+
+	def __iter__(self):
+		return iter(self._row)
+
+	def __reduce__(self):
+		# Rows are always pickled and copied as plain Row objects.
+		return (Row, (self._cols, self._row))
 
 	def __str__(self):
 		return "Row(" + ','.join(map(_fmt, list(zip(self._cols, self._row)))) + ")"
 
 
+class _Column(object):
+	# descriptor for a column of the Row classes made by _RowClass.
+	__slots__ = ("_pos",)
+
+	def __init__(self, pos):
+		self._pos = pos
+
+	def __get__(self, row, owner):
+		if row is None:
+			return self
+		try:
+			return row._row[self._pos]
+		except IndexError:
+			# row is missing trailing columns.
+			raise AttributeError(row._cols[self._pos])
+
+
+_identifier = re.compile("[A-Za-z_][A-Za-z0-9_]*$")
+_rowClasses = {}  # tuple of column names -> Row class
+
+def _RowClass(cols):
+	# returns the Row subclass for a column layout. Its instances have no
+	# __dict__, and columns are looked up in a dict shared by all rows of
+	# the layout, or through a descriptor when accessed as an attribute.
+	layout = tuple(cols)
+	cls = _rowClasses.get(layout)
+	if cls is None:
+		index = {}
+		for i, name in enumerate(layout):
+			index.setdefault(name, i)
+		ns = {"__slots__": (), "_index": index}
+		for name, i in index.items():
+			if isinstance(name, basestring) and _identifier.match(name) and not hasattr(Row, name):
+				ns[str(name)] = _Column(i)
+		if len(_rowClasses) > 1000:
+			_rowClasses.clear()
+		cls = _rowClasses[layout] = type("Row", (Row,), ns)
+	return cls
+
+
 class Rowset(object):
 	# Rowsets are collections of Row objects.
 	#
@@ -823,6 +1853,142 @@ class Rowset(object):
 	#     provided instead of the values tuple.
 	#     When row=True, each result will be decorated with the entire row.
 	#
+	#   ToColumnar()
+	#     Returns a copy of the rowset that stores its data in columns, which
+	#     takes a lot less memory. See ColumnarRowset class below.
+	#
+	#   ToNumpy(*columns)
+	#     Returns a NumPy array with the values of a column. If no or multiple
+	#     columns are given, returns an OrderedDict of column name -> array.
+	#     Columns of ints and floats become int64 and float64 arrays, other
+	#     columns object arrays. Requires NumPy.
+	#
+	#   ToStructured(*columns)
+	#     Returns a NumPy structured array of the given (or all) columns.
+	#
+	#   ToArrow(*columns)
+	#     Returns a pyarrow Table of the given (or all) columns. In columns
+	#     that mix types, empty strings become nulls. Requires pyarrow.
+	#
+	#   For columnar rowsets, the int and float arrays returned by ToNumpy()
+	#   and ToArrow() share memory with the rowset instead of copying it.
+	#
+	#   Where(column, op, value)
+	#     Returns a new rowset of the same kind with the rows for which the
+	#     value in given column compares to value. op is one of "==", "!=",
+	#     "<", "<=", ">", ">=", "in", "not in", or a function taking the
+	#     column value and value. Empty values never compare as smaller or
+	#     greater than anything.
+	#
+	#   Count(by=None)
+	#   Sum(column, by=None)
+	#   Min(column, by=None)
+	#   Max(column, by=None)
+	#   Mean(column, by=None)
+	#     Return the number of rows, or the sum, lowest, highest or average
+	#     value of a column. With by, which is a column name or a sequence of
+	#     column names, these return a dict of key -> result for every key
+	#     found in those column(s) instead. Empty values (None and empty
+	#     strings) are ignored. If there are no values, Sum returns 0 and
+	#     the others return None.
+	#
+	#   These work in a single pass over the rowset. For columnar rowsets they
+	#   use NumPy if it is available.
+	#
+	#   AddIndex(name, columns, unique=False, ordered=False)
+	#     Defines a named index on the given column, or columns (a sequence or
+	#     a comma separated string), in which case the keys are tuples. A
+	#     rowset can have any number of indexes. They are built on their first
+	#     use, and kept up to date with rows appended after that, so repeated
+	#     lookups don't have to scan the rowset. If unique, each key maps to
+	#     a single row (the last one appended). If ordered, the keys are also
+	#     kept sorted for Range(); rows with an empty key are left out of the
+	#     sorted keys.
+	#
+	#   DropIndex(name)
+	#     Removes a named index.
+	#
+	#   Lookup(name, key [, default])
+	#     Returns the rows with given key in the named index, as a rowset of
+	#     the same kind, or the Row itself for a unique index. If there is no
+	#     such key, default is returned if specified. Otherwise a unique index
+	#     raises KeyError and other indexes return an empty rowset.
+	#
+	#   Range(name, low=None, high=None)
+	#     Returns a rowset of the same kind with the rows whose key in the
+	#     named ordered index is between low and high (both inclusive, either
+	#     can be None for no limit), in key order.
+	#
+
+	def AddIndex(self, name, columns, unique=False, ordered=False):
+		if isinstance(columns, basestring):
+			columns = columns.split(",")
+		try:
+			positions = [self._cols.index(column) for column in columns]
+		except ValueError:
+			raise ValueError("Rowset has no column %s" % (columns,))
+		if getattr(self, "_indexes", None) is None:
+			self._indexes = {}
+		self._indexes[name] = _RowsetIndex(positions, unique, ordered)
+
+	def DropIndex(self, name):
+		try:
+			del self._indexes[name]
+		except (AttributeError, KeyError):
+			raise KeyError("Rowset has no index %s" % name)
+
+	def Lookup(self, name, key, *default):
+		index = self._index(name)
+		refs = index.items.get(key, None)
+		if refs is None:
+			if default:
+				return default[0]
+			if index.unique:
+				raise KeyError(key)
+			refs = []
+		if index.unique:
+			return self._fromRef(refs)
+		return self._subset(refs[:])
+
+	def Range(self, name, low=None, high=None):
+		index = self._index(name)
+		if not index.ordered:
+			raise ValueError("index %s is not ordered" % name)
+		keys = index.keys
+		start = 0 if low is None else bisect.bisect_left(keys, low)
+		end = len(keys) if high is None else bisect.bisect_right(keys, high)
+		return self._subset(index.refs[start:end])
+
+	def _index(self, name):
+		# returns the named index, after bringing it up to date.
+		try:
+			index = self._indexes[name]
+		except (AttributeError, KeyError):
+			raise KeyError("Rowset has no index %s" % name)
+		version = self._indexVersion()
+		if index.version != version:
+			index.reset(version)
+		if index.count < len(self._rows):
+			index.update(self._indexEntries(index.columns, index.count))
+			index.count = len(self._rows)
+		return index
+
+	def _indexVersion(self):
+		# indexes of plain rowsets refer to the row lists themselves, but
+		# keep track of the rows indexed so far by position, so they are
+		# rebuilt when the rowset has been sorted.
+		return getattr(self, "_sorts", 0)
+
+	def _indexEntries(self, columns, start):
+		# yields (key, ref) for the rows from position start.
+		rows = itertools.islice(self._rows, start, None)
+		if len(columns) == 1:
+			i = columns[0]
+			return ((row[i], row) for row in rows)
+		return ((tuple([row[i] for i in columns]), row) for row in rows)
+
+	def _fromRef(self, ref):
+		return self._rowclass()(self._cols, ref)
 
 	def IndexedBy(self, column):
 		return IndexRowset(self._cols, self._rows, column)
@@ -839,6 +2005,71 @@ class Rowset(object):
 		rs.SortBy(column, reverse, dtype)
 		return rs
 
+	def ToColumnar(self):
+		return ColumnarRowset(self._cols, self._rows)
+
+	def ToNumpy(self, *columns):
+		numpy = _Import("numpy", "ToNumpy()")
+		arrays = [(column, _NumpyColumn(numpy, self._column(column))) for column in (columns or self._cols)]
+		if len(columns) == 1:
+			return arrays[0][1]
+		return OrderedDict(arrays)
+
+	def ToStructured(self, *columns):
+		numpy = _Import("numpy", "ToStructured()")
+		arrays = [(str(column), _NumpyColumn(numpy, self._column(column))) for column in (columns or self._cols)]
+		result = numpy.empty(len(self), dtype=[(column, a.dtype) for column, a in arrays])
+		for column, a in arrays:
+			result[column] = a
+		return result
+
+	def ToArrow(self, *columns):
+		pyarrow = _Import("pyarrow", "ToArrow()")
+		columns = columns or self._cols
+		return pyarrow.Table.from_arrays([_ArrowColumn(pyarrow, self._column(column)) for column in columns], names=list(columns))
+
+	def _column(self, column):
+		# returns the values of a column, stored as ColumnarRowset would.
+		return _MakeColumn(list(self.Select(column)))
+
+	def Where(self, column, op, value):
+		test = _Test(op)
+		i = self._cols.index(column)
+		return self._subset([row for row in self._rows if test(row[i], value)])
+
+	def Count(self, by=None):
+		if by is None:
+			return len(self._rows)
+		return self._aggregate(None, by, "count")
+
+	def Sum(self, column, by=None):
+		return self._aggregate(column, by, "sum")
+
+	def Min(self, column, by=None):
+		return self._aggregate(column, by, "min")
+
+	def Max(self, column, by=None):
+		return self._aggregate(column, by, "max")
+
+	def Mean(self, column, by=None):
+		return self._aggregate(column, by, "mean")
+
+	def _subset(self, rows):
+		# returns a rowset like this one with the given rows.
+		return Rowset(self._cols, rows)
+
+	def _values(self, column):
+		return map(operator.itemgetter(self._cols.index(column)), self._rows)
+
+	def _aggregate(self, column, by, how):
+		if by is None:
+			keys = None
+		elif isinstance(by, basestring):
+			keys = self._values(by)
+		else:
+			keys = zip(*[self._values(key) for key in by])
+		return _Aggregate(column and self._values(column), keys, how)
+
 	def Select(self, *columns, **options):
 		if len(columns) == 1:
 			i = self._cols.index(columns[0])
@@ -864,6 +2095,15 @@ class Rowset(object):
 		self._cols = cols or []
 		self._rows = rows or []
 
+	def _rowclass(self):
+		# returns the Row class for the current column layout. Note that
+		# the parser may still add columns while building the rowset.
+		cols = self._cols
+		rc = getattr(self, "_rc", None)
+		if rc is None or rc[0] is not cols or rc[1] != len(cols):
+			rc = self._rc = (cols, len(cols), _RowClass(cols))
+		return rc[2]
+
 	def append(self, row):
 		if isinstance(row, list):
 			self._rows.append(row)
@@ -887,13 +2127,17 @@ class Rowset(object):
 	def copy(self):
 		return self[:]
 
+	def __iter__(self):
+		return map(functools.partial(self._rowclass(), self._cols), self._rows)
+
 	def __getitem__(self, ix):
 		if type(ix) is slice:
 			return Rowset(self._cols, self._rows[ix])
-		return Row(self._cols, self._rows[ix])
+		return self._rowclass()(self._cols, self._rows[ix])
 
 	def sort(self, *args, **kw):
 		self._rows.sort(*args, **kw)
+		self._sorts = getattr(self, "_sorts", 0) + 1
 
 	def __str__(self):
 		return ("Rowset(columns=[%s], rows=%d)" % (','.join(self._cols), len(self)))
@@ -916,6 +2160,79 @@ class IndexRowset(Rowset):
 	#     such key in the index, KeyError is raised unless a default value was
 	#     specified.
 	#
+	#   Diff(other, ignore=None)
+	#     Compares this rowset with an older version of it, matching rows on
+	#     their key. Returns (added, changed, removed) rowsets, with the rows
+	#     of this rowset whose key is not in other, the rows of this rowset
+	#     that differ from the row with the same key in other, and the rows
+	#     of other whose key is not in this rowset. Columns are matched by
+	#     name; columns that are not in both rowsets, and those listed in
+	#     ignore, are not compared. Nested rowsets are compared by value.
+	#
+	#   Changes(other, ignore=None)
+	#     Same as Diff, but returns the differences as a list of plain
+	#     (change, key, values) tuples, with change being "added", "changed"
+	#     or "removed". For added and removed rows values is a dict of
+	#     column -> value, for changed rows a dict of column -> (old, new)
+	#     with only the compared columns that changed.
+	#
+
+	def Diff(self, other, ignore=None):
+		added, changed, removed = self._diff(other, ignore)[1:]
+		return self._subset([ref for key, ref in added]), self._subset([ref for key, ref, oref in changed]), other._subset([ref for key, ref in removed])
+
+	def Changes(self, other, ignore=None):
+		pairs, added, changed, removed = self._diff(other, ignore)
+		result = [("added", key, dict(zip(self._cols, self._refRow(ref)))) for key, ref in added]
+		for key, ref, oref in changed:
+			row = self._refRow(ref)
+			orow = other._refRow(oref)
+			values = {}
+			for column, i, j in pairs:
+				a = _RowValue(orow, j)
+				b = _RowValue(row, i)
+				if not _Same(a, b):
+					values[column] = (a, b)
+			result.append(("changed", key, values))
+		result.extend(("removed", key, dict(zip(other._cols, other._refRow(ref)))) for key, ref in removed)
+		return result
+
+	def _diff(self, other, ignore):
+		# returns the compared (column, i, j) column positions in self and
+		# other, and the (key, ref) of added rows, (key, ref, otherRef) of
+		# changed rows and (key, otherRef) of removed rows.
+		ignore = set(ignore or ())
+		ocols = other._cols
+		pairs = [(column, i, ocols.index(column)) for i, column in enumerate(self._cols) if column in ocols and column not in ignore]
+		sameLayout = self._cols == ocols
+
+		items = self._keyItems()
+		oitems = other._keyItems()
+		added = []
+		changed = []
+		for key, ref in items.items():
+			if key not in oitems:
+				added.append((key, ref))
+				continue
+			oref = oitems[key]
+			row = self._refRow(ref)
+			orow = other._refRow(oref)
+			if sameLayout and row == orow:
+				continue
+			for column, i, j in pairs:
+				if not _Same(_RowValue(row, i), _RowValue(orow, j)):
+					changed.append((key, ref, oref))
+					break
+		removed = [(key, ref) for key, ref in oitems.items() if key not in items]
+		return pairs, added, changed, removed
+
+	def _keyItems(self):
+		# returns the key -> ref index.
+		return self._items
+
+	def _refRow(self, ref):
+		return ref
+
 
 	def Get(self, key, *default):
 		row = self._items.get(key, None)
@@ -923,7 +2240,7 @@ class IndexRowset(Rowset):
 			if default:
 				return default[0]
 			raise KeyError(key)
-		return Row(self._cols, row)
+		return self._rowclass()(self._cols, row)
 
 	# -------------
 
@@ -946,6 +2263,12 @@ class IndexRowset(Rowset):
 		else:
 			self._items = dict((row[ki], row) for row in self._rows)
 
+	def ToColumnar(self):
+		return ColumnarIndexRowset(self._cols, self._rows, self._key)
+
+	def _subset(self, rows):
+		return IndexRowset(self._cols, rows, self._key)
+
 	def __getitem__(self, ix):
 		if type(ix) is slice:
 			return IndexRowset(self._cols, self._rows[ix], self._key)
@@ -959,11 +2282,35 @@ class IndexRowset(Rowset):
 			self._items[row[self._ki]] = row
 
 	def __getstate__(self):
-		return (Rowset.__getstate__(self), self._items, self._ki)
+		# the index is rebuilt when unpickling, rather than pickled.
+		return (Rowset.__getstate__(self), self._key)
 
 	def __setstate__(self, state):
-		state, self._items, self._ki = state
-		Rowset.__setstate__(self, state)
+		if len(state) == 3:
+			# pickled by an older version, with the index.
+			state, self._items, self._ki = state
+			Rowset.__setstate__(self, state)
+			return
+		(cols, rows), key = state
+		IndexRowset.__init__(self, cols, rows, key)
+
+
+def _RowValue(row, i):
+	# rows can be shorter than their columns when the parser added columns
+	# after they were made.
+	return row[i] if i < len(row) else None
+
+def _Same(a, b):
+	# compares two values, and nested rowsets by value.
+	if isinstance(a, Rowset) and isinstance(b, Rowset):
+		if a._cols != b._cols or len(a) != len(b):
+			return False
+		n = len(a._cols)
+		for ra, rb in zip(a._rows, b._rows):
+			if ra != rb and not all(_Same(_RowValue(ra, i), _RowValue(rb, i)) for i in range(n)):
+				return False
+		return True
+	return a == b
 
 
 class FilterRowset(object):
@@ -1025,8 +2372,2079 @@ class FilterRowset(object):
 		return Rowset(self._cols, self._items[i])
 
 	def __getstate__(self):
-		return (self._cols, self._rows, self._items, self.key, self.key2)
+		return (self._cols, self._items, self.key, self.key2)
 
 	def __setstate__(self, state):
-		self._cols, self._rows, self._items, self.key, self.key2 = state
+		self._cols, self._items, self.key, self.key2 = state
 		self._bind()
+
+
+class _RowsetIndex(object):
+	# A named index of a rowset (see Rowset.AddIndex). It maps keys to refs,
+	# which are row lists for plain rowsets and row positions for columnar
+	# ones. Ordered indexes also keep the keys in sorted order, with the refs
+	# in a parallel list, for bisecting.
+
+	def __init__(self, columns, unique, ordered):
+		self.columns = columns
+		self.unique = unique
+		self.ordered = ordered
+		self.reset(None)
+
+	def reset(self, version):
+		self.items = {}
+		self.keys = []
+		self.refs = []
+		self.count = 0  # number of rows indexed.
+		self.version = version
+
+	def update(self, entries):
+		items = self.items
+		if self.unique:
+			if self.ordered:
+				for key, ref in entries:
+					replace = key in items
+					items[key] = ref
+					self._insert(key, ref, replace)
+			else:
+				items.update(entries)
+		else:
+			for key, ref in entries:
+				if key in items:
+					items[key].append(ref)
+				else:
+					items[key] = [ref]
+				if self.ordered:
+					self._insert(key, ref, False)
+
+	def _insert(self, key, ref, replace):
+		if key in _empty or (type(key) is tuple and (None in key or "" in key)):
+			return
+		keys = self.keys
+		if replace:
+			self.refs[bisect.bisect_left(keys, key)] = ref
+		elif not keys or key >= keys[-1]:
+			# rows usually arrive in key order.
+			keys.append(key)
+			self.refs.append(ref)
+		else:
+			i = bisect.bisect_right(keys, key)
+			keys.insert(i, key)
+			self.refs.insert(i, ref)
+
+
+try:
+	array.array("q")
+	_int64 = "q"
+except ValueError:
+	# no long long arrays (Python 2)
+	_int64 = "l"
+
+# columns can also be memoryviews cast to an array type, which is how the
+# rowsets of frozen files (see OpenFrozen) refer to the file's data.
+_arrayTypes = (array.array, memoryview)
+
+def _typecode(col):
+	return col.typecode if isinstance(col, array.array) else col.format
+
+def _fits(typecode, value):
+	# checks if value can be stored in an array of given type without
+	# changing its type or value.
+	if typecode == "d":
+		return type(value) is float
+	return type(value) in (int, long) and -0x8000000000000000 <= value <= 0x7fffffffffffffff
+
+
+class _DictColumn(object):
+	# Dictionary-encoded column. Each distinct value is stored only once,
+	# the column itself is an array of 4-byte codes referring to the
+	# values. Columns taken from this one share its values, which is safe
+	# as values are only ever added.
+
+	def __init__(self, values=None, lookup=None):
+		self.values = [] if values is None else values
+		self._lookup = {} if lookup is None else lookup
+		self.codes = array.array("i")
+
+	def append(self, value):
+		# values are looked up by type too, so that 1, 1.0 and True don't
+		# end up as the same value.
+		key = (type(value), value)
+		code = self._lookup.get(key)
+		if code is None:
+			code = self._lookup[key] = len(self.values)
+			self.values.append(value)
+		try:
+			self.codes.append(code)
+		except BufferError:
+			# codes are exported (see _NumpyColumn), continue with a copy.
+			self.codes = array.array("i", self.codes)
+			self.codes.append(code)
+
+	def take(self, positions, index=None):
+		codes = _TakeArray(self.codes, positions, index)
+		if isinstance(self.values, list):
+			col = _DictColumn(self.values, self._lookup)
+			col.codes = codes
+			return col
+		# the values are the string table of a frozen file, which can't be
+		# added to. Copies get their own values, with only the ones used.
+		remap = {}
+		for code in codes:
+			remap.setdefault(code, len(remap))
+		values = [self.values[code] for code in remap]
+		col = _DictColumn(values, dict(((type(v), v), code) for code, v in enumerate(values)))
+		col.codes = array.array("i", [remap[code] for code in codes])
+		return col
+
+	def __getitem__(self, i):
+		return self.values[self.codes[i]]
+
+	def __len__(self):
+		return len(self.codes)
+
+	def __iter__(self):
+		return map(self.values.__getitem__, self.codes)
+
+
+def _MakeColumn(values):
+	# returns the most compact storage for a column of values: a typed
+	# array for ints and floats, a _DictColumn for other values that are
+	# repeated a lot, and a list otherwise.
+	types = set(map(type, values))
+	if types and types <= set((int, long)):
+		try:
+			return array.array(_int64, values)
+		except OverflowError:
+			pass
+	elif types == set((float,)):
+		return array.array("d", values)
+	elif values:
+		try:
+			col = _DictColumn()
+			limit = len(values) // 2
+			for value in values:
+				col.append(value)
+				if len(col.values) > limit:
+					break
+			else:
+				return col
+		except TypeError:
+			# unhashable values
+			pass
+	return list(values)
+
+def _TakeArray(data, positions, index):
+	# takes values from a typed array, using NumPy if an index array for
+	# the positions was made.
+	if index is None:
+		return array.array(_typecode(data), [data[i] for i in positions])
+	result = array.array(_typecode(data))
+	frombytes = getattr(result, "frombytes", None) or result.fromstring
+	frombytes(_OptionalNumpy().frombuffer(data, dtype=_typecode(data))[index].tobytes())
+	return result
+
+def _TakeColumn(col, positions, index=None):
+	# returns a new column with the values of col at the given positions.
+	if isinstance(col, _arrayTypes):
+		return _TakeArray(col, positions, index)
+	if isinstance(col, _DictColumn):
+		return col.take(positions, index)
+	return [col[i] for i in positions]
+
+
+class _ColumnStore(object):
+	# Sequence of rows stored as columns, used as the _rows of columnar
+	# rowsets. It supports the part of the list interface that rowsets use,
+	# and builds row lists on demand. Rows shorter than the number of
+	# columns are padded with None.
+
+	readonly = False  # set for stores that refer to a frozen file.
+
+	def __init__(self, columns, length):
+		self.columns = columns
+		self._length = length
+		self._version = 0  # changes whenever rows are reordered.
+
+	def __len__(self):
+		return self._length
+
+	def __bool__(self):
+		return self._length > 0
+
+	def __getitem__(self, ix):
+		if type(ix) is slice:
+			return self.take(range(*ix.indices(self._length)))
+		if ix < 0:
+			ix += self._length
+		if not 0 <= ix < self._length:
+			raise IndexError("row index out of range")
+		return [col[ix] for col in self.columns]
+
+	def __iter__(self):
+		if not self.columns:
+			return iter([[] for i in range(self._length)])
+		return map(list, zip(*self.columns))
+
+	def append(self, row):
+		if self.readonly:
+			raise TypeError("rowset is read-only")
+		columns = self.columns
+		if len(row) < len(columns):
+			row = list(row) + [None] * (len(columns) - len(row))
+		for i, col in enumerate(columns):
+			value = row[i]
+			if isinstance(col, _arrayTypes) and not _fits(_typecode(col), value):
+				col = columns[i] = list(col)
+			try:
+				col.append(value)
+			except BufferError:
+				# the array is exported to NumPy or Arrow, which means it
+				# can't grow. Those keep the old data, we continue with a copy.
+				col = columns[i] = array.array(col.typecode, col)
+				col.append(value)
+			except TypeError:
+				# unhashable value for a _DictColumn
+				col = columns[i] = list(col)
+				col.append(value)
+		self._length += 1
+
+	def extend(self, rows):
+		for row in rows:
+			self.append(row)
+
+	def __iadd__(self, rows):
+		self.extend(rows)
+		return self
+
+	def take(self, positions):
+		# returns a new store with the rows at the given positions, which
+		# may also be given as a NumPy array.
+		numpy = _OptionalNumpy()
+		index = None
+		if numpy is not None and len(positions) >= 1000:
+			index = numpy.asarray(positions, dtype=numpy.intp)
+		positions = positions.tolist() if hasattr(positions, "tolist") else list(positions)
+		return _ColumnStore([_TakeColumn(col, positions, index) for col in self.columns], len(positions))
+
+	def reorder(self, positions):
+		# rearranges the rows in the order given by positions.
+		if self.readonly:
+			raise TypeError("rowset is read-only")
+		self.columns = self.take(positions).columns
+		self._version += 1
+
+	def __getstate__(self):
+		# columns referring to a frozen file are pickled as regular ones,
+		# and the copy can be modified.
+		state = self.__dict__.copy()
+		state.pop("readonly", None)
+		state["columns"] = [_OwnedColumn(col) for col in self.columns]
+		return state
+
+	def sort(self, key=None, reverse=False):
+		if key is None:
+			order = sorted(range(self._length), key=self.__getitem__, reverse=reverse)
+		else:
+			order = sorted(range(self._length), key=lambda i: key(self[i]), reverse=reverse)
+		self.reorder(order)
+
+
+def _Import(module, feature):
+	# imports an optional dependency.
+	try:
+		return __import__(module)
+	except ImportError:
+		raise ImportError("%s requires the %s package" % (feature, module))
+
+def _ObjectArray(numpy, values):
+	# (filled one by one, so values that look like sequences are kept as is)
+	result = numpy.empty(len(values), dtype=object)
+	for i, value in enumerate(values):
+		result[i] = value
+	return result
+
+def _NumpyColumn(numpy, col):
+	if isinstance(col, _arrayTypes):
+		return numpy.frombuffer(col, dtype=_typecode(col))
+	if isinstance(col, _DictColumn):
+		return _ObjectArray(numpy, col.values)[numpy.frombuffer(col.codes, dtype="i")]
+	return _ObjectArray(numpy, col)
+
+def _ArrowValues(pyarrow, values):
+	errors = (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError)
+	try:
+		return pyarrow.array(values)
+	except errors:
+		pass
+	# mixed types; the API uses empty strings for missing values.
+	values = [None if isinstance(value, basestring) and not value else value for value in values]
+	try:
+		return pyarrow.array(values)
+	except errors:
+		return pyarrow.array([None if value is None else str(value) for value in values])
+
+def _ArrowColumn(pyarrow, col):
+	if isinstance(col, _arrayTypes):
+		if _typecode(col) == "d":
+			kind = pyarrow.float64()
+		else:
+			kind = pyarrow.int64() if col.itemsize == 8 else pyarrow.int32()
+		return pyarrow.Array.from_buffers(kind, len(col), [None, pyarrow.py_buffer(col)])
+	if isinstance(col, _DictColumn):
+		indices = pyarrow.Array.from_buffers(pyarrow.int32(), len(col), [None, pyarrow.py_buffer(col.codes)])
+		return pyarrow.DictionaryArray.from_arrays(indices, _ArrowValues(pyarrow, col.values))
+	return _ArrowValues(pyarrow, col)
+
+
+_empty = (None, "")
+
+_tests = {
+	"==": operator.eq,
+	"!=": operator.ne,
+	"<": lambda a, b: a not in _empty and a < b,
+	"<=": lambda a, b: a not in _empty and a <= b,
+	">": lambda a, b: a not in _empty and a > b,
+	">=": lambda a, b: a not in _empty and a >= b,
+	"in": lambda a, b: a in b,
+	"not in": lambda a, b: a not in b,
+}
+
+# the comparison operators for NumPy arrays.
+_arrayTests = {
+	"==": operator.eq,
+	"!=": operator.ne,
+	"<": operator.lt,
+	"<=": operator.le,
+	">": operator.gt,
+	">=": operator.ge,
+}
+
+def _Test(op):
+	# returns the function for a Where() operator.
+	if callable(op):
+		return op
+	try:
+		return _tests[op]
+	except KeyError:
+		raise ValueError("unknown operator %r" % (op,))
+
+def _Aggregate(values, keys, how):
+	# computes Count/Sum/Min/Max/Mean in a single pass. values and keys are
+	# iterables of column values and group keys, or None.
+	if how == "count":
+		return dict(Counter(keys))
+
+	if keys is None:
+		values = [value for value in values if value not in _empty]
+		if how == "sum":
+			return sum(values)
+		if not values:
+			return None
+		if how == "mean":
+			return sum(values) / len(values)
+		return min(values) if how == "min" else max(values)
+
+	result = {}
+	if how == "min":
+		for key, value in zip(keys, values):
+			if value not in _empty and (key not in result or value < result[key]):
+				result[key] = value
+	elif how == "max":
+		for key, value in zip(keys, values):
+			if value not in _empty and (key not in result or value > result[key]):
+				result[key] = value
+	else:
+		counts = {}
+		for key, value in zip(keys, values):
+			if value not in _empty:
+				if key in result:
+					result[key] += value
+					counts[key] += 1
+				else:
+					result[key] = value
+					counts[key] = 1
+		if how == "mean":
+			for key, count in counts.items():
+				result[key] /= count
+	return result
+
+_numpy = []
+
+def _OptionalNumpy():
+	# returns the numpy module, or None if it is not installed.
+	if not _numpy:
+		try:
+			import numpy
+		except ImportError:
+			numpy = None
+		_numpy.append(numpy)
+	return _numpy[0]
+
+def _NumpyWhere(numpy, col, op, value):
+	# returns the positions of the matching values in a typed array column,
+	# or None if the comparison can't be done by NumPy.
+	if op in ("in", "not in"):
+		if not all(type(v) in (int, long, float) for v in value):
+			return None
+	elif type(value) not in (int, long, float):
+		return None
+	data = numpy.frombuffer(col, dtype=_typecode(col))
+	try:
+		if op == "in":
+			mask = numpy.isin(data, list(value))
+		elif op == "not in":
+			mask = numpy.isin(data, list(value), invert=True)
+		else:
+			mask = _arrayTests[op](data, value)
+	except (OverflowError, TypeError):
+		return None
+	return numpy.flatnonzero(mask)
+
+def _NumpyAggregate(numpy, col, keycol, how):
+	# NumPy version of _Aggregate for typed array columns, grouped by a
+	# typed array or dictionary-encoded column. Returns _unspecified for
+	# anything else.
+	if how != "count" and not isinstance(col, _arrayTypes):
+		return _unspecified
+
+	if keycol is None:
+		data = numpy.frombuffer(col, dtype=_typecode(col))
+		if how == "sum":
+			return data.sum().item()
+		if not len(data):
+			return None
+		return getattr(data, how)().item()
+
+	if isinstance(keycol, _DictColumn):
+		groups = numpy.frombuffer(keycol.codes, dtype="i")
+		keys = keycol.values
+		if how == "count":
+			counts = numpy.bincount(groups, minlength=len(keys)).tolist()
+			return dict((key, count) for key, count in zip(keys, counts) if count)
+	elif isinstance(keycol, _arrayTypes):
+		if how == "count":
+			keys, counts = numpy.unique(numpy.frombuffer(keycol, dtype=_typecode(keycol)), return_counts=True)
+			return dict(zip(keys.tolist(), counts.tolist()))
+		keys, groups = numpy.unique(numpy.frombuffer(keycol, dtype=_typecode(keycol)), return_inverse=True)
+		keys = keys.tolist()
+	else:
+		return _unspecified
+
+	if not len(groups):
+		return {}
+
+	# sort the rows by group, then reduce each run of rows.
+	order = numpy.argsort(groups, kind="stable")
+	groups = groups[order]
+	starts = numpy.flatnonzero(numpy.concatenate(([True], groups[1:] != groups[:-1])))
+	keys = [keys[group] for group in groups[starts].tolist()]
+	data = numpy.frombuffer(col, dtype=_typecode(col))[order]
+	if how == "min":
+		result = numpy.minimum.reduceat(data, starts)
+	elif how == "max":
+		result = numpy.maximum.reduceat(data, starts)
+	else:
+		result = numpy.add.reduceat(data, starts)
+		if how == "mean":
+			result = result / numpy.diff(numpy.append(starts, len(groups)))
+	return dict(zip(keys, result.tolist()))
+
+
+def _OwnedColumn(col):
+	# returns a column that does not refer to the data of a frozen file.
+	if isinstance(col, memoryview):
+		return array.array(_typecode(col), col)
+	if isinstance(col, _DictColumn) and not (isinstance(col.values, list) and isinstance(col.codes, array.array)):
+		return col.take(range(len(col)))
+	return col
+
+def _ColumnStoreFromRows(ncols, rows):
+	columns = [_MakeColumn([row[i] if i < len(row) else None for row in rows]) for i in range(ncols)]
+	return _ColumnStore(columns, len(rows))
+
+
+class ColumnarRowset(Rowset):
+	# A ColumnarRowset is a Rowset that keeps its data in columns instead of
+	# rows, to save memory on large rowsets. Columns of ints and floats are
+	# stored in arrays of 8 bytes per value, other columns with a lot of
+	# repeated values (such as names) are dictionary-encoded at 4 bytes per
+	# value, and anything else is kept in a list. Appended values that do
+	# not fit a column's storage change it to a list.
+	#
+	# The interface is the same as Rowset, with rows being built when they
+	# are accessed. Select() and SortBy() work on the columns directly,
+	# IndexedBy() returns a ColumnarIndexRowset that shares the columns,
+	# and GroupedBy() a FilterRowset with the groups stored as columns.
+	#
+	# Any rowset can be converted with its ToColumnar() method.
+
+	def IndexedBy(self, column):
+		return ColumnarIndexRowset(self._cols, self._rows, column)
+
+	def GroupedBy(self, column):
+		groups = {}
+		for i, value in enumerate(self._rows.columns[self._cols.index(column)]):
+			if value in groups:
+				groups[value].append(i)
+			else:
+				groups[value] = [i]
+		take = self._rows.take
+		return FilterRowset(self._cols, None, column, dict=dict((value, take(positions)) for value, positions in groups.items()))
+
+	def SortBy(self, column, reverse=False, dtype=str):
+		keys = list(map(dtype, self._rows.columns[self._cols.index(column)]))
+		self._rows.reorder(sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse))
+
+	def Select(self, *columns, **options):
+		data = self._rows.columns
+		if len(columns) == 1:
+			values = iter(data[self._cols.index(columns[0])])
+		else:
+			values = map(list, zip(*[data[self._cols.index(column)] for column in columns]))
+		if options.get("row", False):
+			return zip(iter(self._rows), values)
+		return values
+
+	def ToColumnar(self):
+		return self
+
+	def _column(self, column):
+		return self._rows.columns[self._cols.index(column)]
+
+	def Where(self, column, op, value):
+		col = self._column(column)
+		test = _Test(op)
+		numpy = _OptionalNumpy()
+		positions = None
+		if isinstance(col, _DictColumn):
+			# test the distinct values, then find their codes.
+			matches = [code for code, v in enumerate(col.values) if test(v, value)]
+			if numpy is not None:
+				positions = numpy.flatnonzero(numpy.isin(numpy.frombuffer(col.codes, dtype="i"), matches))
+			else:
+				matches = set(matches)
+				positions = [i for i, code in enumerate(col.codes) if code in matches]
+		elif numpy is not None and isinstance(col, _arrayTypes) and op in _tests:
+			positions = _NumpyWhere(numpy, col, op, value)
+		if positions is None:
+			positions = [i for i, v in enumerate(col) if test(v, value)]
+		return self._subset(positions)
+
+	def _subset(self, positions):
+		return ColumnarRowset(self._cols, self._rows.take(positions))
+
+	def _values(self, column):
+		return iter(self._column(column))
+
+	def _indexVersion(self):
+		# indexes of columnar rowsets refer to row positions, which change
+		# when the rows are reordered.
+		return self._rows._version
+
+	def _indexEntries(self, columns, start):
+		data = self._rows.columns
+		if len(columns) == 1:
+			keys = itertools.islice(data[columns[0]], start, None)
+		else:
+			keys = zip(*[itertools.islice(data[i], start, None) for i in columns])
+		return zip(keys, itertools.count(start))
+
+	def _fromRef(self, ref):
+		return self._rowclass()(self._cols, self._rows[ref])
+
+	def _aggregate(self, column, by, how):
+		numpy = _OptionalNumpy()
+		if numpy is not None and (by is None or isinstance(by, basestring)):
+			result = _NumpyAggregate(numpy, column and self._column(column), by and self._column(by), how)
+			if result is not _unspecified:
+				return result
+		return Rowset._aggregate(self, column, by, how)
+
+	# -------------
+
+	def __init__(self, cols=None, rows=None):
+		self._cols = cols or []
+		if not isinstance(rows, _ColumnStore):
+			rows = _ColumnStoreFromRows(len(self._cols), rows or [])
+		self._rows = rows
+
+	def __getitem__(self, ix):
+		if type(ix) is slice:
+			return ColumnarRowset(self._cols, self._rows[ix])
+		return self._rowclass()(self._cols, self._rows[ix])
+
+
+class ColumnarIndexRowset(ColumnarRowset, IndexRowset):
+	# The columnar version of IndexRowset. The index maps keys to row
+	# positions, and is rebuilt when the rows have been reordered.
+
+	def Get(self, key, *default):
+		if self._version != self._rows._version:
+			self._reindex()
+		i = self._items.get(key, None)
+		if i is None:
+			if default:
+				return default[0]
+			raise KeyError(key)
+		return self._rowclass()(self._cols, self._rows[i])
+
+	def ToColumnar(self):
+		return self
+
+	# -------------
+
+	def __init__(self, cols=None, rows=None, key=None):
+		ColumnarRowset.__init__(self, cols, rows)
+		try:
+			if "," in key:
+				self._ki = [self._cols.index(k) for k in key.split(",")]
+				self.composite = True
+			else:
+				self._ki = self._cols.index(key)
+				self.composite = False
+		except ValueError:
+			raise ValueError("Rowset has no column %s" % key)
+		self._key = key
+		self._reindex()
+
+	def _reindex(self):
+		data = self._rows.columns
+		if self.composite:
+			keys = zip(*[data[k] for k in self._ki])
+		else:
+			keys = data[self._ki]
+		self._items = dict(zip(keys, range(len(self._rows))))
+		self._version = self._rows._version
+
+	def __getitem__(self, ix):
+		if type(ix) is slice:
+			return ColumnarIndexRowset(self._cols, self._rows[ix], self._key)
+		return ColumnarRowset.__getitem__(self, ix)
+
+	def _keyItems(self):
+		if self._version != self._rows._version:
+			self._reindex()
+		return self._items
+
+	def _refRow(self, ref):
+		return self._rows[ref]
+
+	def _subset(self, positions):
+		return ColumnarIndexRowset(self._cols, self._rows.take(positions), self._key)
+
+	def append(self, row):
+		Rowset.append(self, row)
+		if isinstance(row, Row):
+			row = row._row
+		if self.composite:
+			self._items[tuple([row[k] for k in self._ki])] = len(self._rows) - 1
+		else:
+			self._items[row[self._ki]] = len(self._rows) - 1
+
+	def __getstate__(self):
+		return (self._cols, self._rows, self._key)
+
+	def __setstate__(self, state):
+		self.__init__(*state)
+
+
+class FrozenIndexRowset(ColumnarIndexRowset):
+	# The IndexRowsets of files opened with OpenFrozen(). Instead of a dict,
+	# the index is the array of row positions in key order stored in the
+	# file, which is searched by bisection. Like the columns, it is not
+	# loaded into memory but read from the file, so all processes that open
+	# the file share it. The dict is only built when Diff() needs it.
+	#
+	# Frozen rowsets are read-only. Slicing one (rs[:]), copying or pickling
+	# it returns a regular ColumnarIndexRowset.
+
+	def Get(self, key, *default):
+		i = self._find(key)
+		if i is None:
+			if default:
+				return default[0]
+			raise KeyError(key)
+		return self._rowclass()(self._cols, self._rows[i])
+
+	# -------------
+
+	def __init__(self, cols, rows, key, order):
+		self._order = order
+		ColumnarIndexRowset.__init__(self, cols, rows, key)
+
+	def __reduce__(self):
+		# copies and pickles are regular ColumnarIndexRowsets.
+		return (ColumnarIndexRowset, (self._cols, self._rows, self._key))
+
+	def _reindex(self):
+		self._items = None
+		self._version = self._rows._version
+
+	def _keyItems(self):
+		if self._items is None:
+			ColumnarIndexRowset._reindex(self)
+		return self._items
+
+	def _find(self, key):
+		# returns the position of the last row with given key, like the
+		# dict index would, or None.
+		data = self._rows.columns
+		order = self._order
+		if self.composite:
+			cols = [data[k] for k in self._ki]
+			keyAt = lambda i: tuple([col[order[i]] for col in cols])
+		else:
+			col = data[self._ki]
+			keyAt = lambda i: col[order[i]]
+		lo, hi = 0, len(order)
+		try:
+			while lo < hi:
+				mid = (lo + hi) // 2
+				if key < keyAt(mid):
+					hi = mid
+				else:
+					lo = mid + 1
+		except TypeError:
+			return None  # key of another type.
+		if lo and keyAt(lo - 1) == key:
+			return order[lo - 1]
+		return None
+
+
+
+#-----------------------------------------------------------------------------
+# Binary Format
+#-----------------------------------------------------------------------------
+# PackResult() stores API results (or any Element or Rowset) in a compact
+# binary format, which loads a lot faster than XML or pickles and can be
+# read straight from a memory map. A packed object consists of:
+#
+#   header  - magic "EVEAPI", format version (uint16), number of strings
+#             and offset of the body (uint32 each).
+#   strings - every string in the object, once: uint32 size and the UTF-8
+#             strings separated by NUL characters, followed (from version
+#             2, aligned to 4 bytes) by uint32 offsets of every string and
+#             the end of the last one.
+#   body    - the object as a tagged value (see _BinaryWriter.value).
+#
+# All numbers are little-endian. Rowsets are stored column by column, with
+# int and float columns as arrays of 8 byte values aligned to 8 bytes, and
+# other columns as arrays of 4 byte indexes into the strings or into a list
+# of their distinct values. From version 3, rowsets keep their name and
+# tuples are stored as tuples rather than lists.
+# The indexes of rowsets are rebuilt when loading rather than stored. Only
+# frozen files (see FreezeResult) contain an array of the row positions of
+# IndexRowsets in key order, which is searched instead.
+#-----------------------------------------------------------------------------
+
+_binaryMagic = b"EVEAPI"
+_binaryVersion = 3
+_binaryHeader = struct.Struct("<6sHII")
+_u32 = struct.Struct("<I")
+_i64 = struct.Struct("<q")
+_f64 = struct.Struct("<d")
+_littleEndian = sys.byteorder == "little"
+
+# rowset classes by their kind number in the format.
+_rowsetKinds = [Rowset, IndexRowset, ColumnarRowset, ColumnarIndexRowset]
+
+_intTypes = set([int, long])
+_stringTypes = set([str, type(u"")])
+
+def _ArrayBytes(col, tag):
+	# returns the little-endian data of an 8 byte array column.
+	if _littleEndian and col.itemsize == 8:
+		return col.tobytes() if hasattr(col, "tobytes") else col.tostring()
+	return struct.pack("<%d%s" % (len(col), tag), *col)
+
+
+class _BinaryWriter(object):
+	# Builds the binary representation of an object. Elements are assigned
+	# a number when they are first written, later occurrences are written
+	# as references, because results refer back to their document (_meta).
+
+	def __init__(self, keyOrder=False):
+		self.keyOrder = keyOrder
+		self.strings = {}
+		self.chunks = []
+		self.size = 0
+		self.elements = {}
+		self._keep = []  # keeps the ids in elements valid.
+
+	def write(self, data):
+		self.chunks.append(data)
+		self.size += len(data)
+
+	def align(self):
+		if self.size % 8:
+			self.write(b"\0" * (8 - self.size % 8))
+
+	def string(self, s):
+		if isinstance(s, bytes):
+			s = s.decode("utf-8")
+		i = self.strings.get(s)
+		if i is None:
+			i = self.strings[s] = len(self.strings)
+		return i
+
+	def value(self, v):
+		# tags: N None, T/F bools, i int64, l big int (decimal string), d
+		# float, D Decimal (string), s string, [ list, ( tuple, E element, r
+		# element reference, R rowset.
+		if v is None:
+			self.write(b"N")
+		elif v is True or v is False:
+			self.write(b"T" if v else b"F")
+		elif isinstance(v, (int, long)):
+			if -2**63 <= v < 2**63:
+				self.write(b"i" + _i64.pack(v))
+			else:
+				self.write(b"l" + _u32.pack(self.string(str(v))))
+		elif isinstance(v, float):
+			self.write(b"d" + _f64.pack(v))
+		elif isinstance(v, decimal.Decimal):
+			# ISK amounts, when schemas.iskType is Decimal.
+			self.write(b"D" + _u32.pack(self.string(str(v))))
+		elif isinstance(v, basestring):
+			self.write(b"s" + _u32.pack(self.string(v)))
+		elif isinstance(v, (list, tuple, _MappedStrings)):
+			self.write((b"(" if isinstance(v, tuple) else b"[") + _u32.pack(len(v)))
+			for item in v:
+				self.value(item)
+		elif isinstance(v, Element):
+			self.element(v)
+		elif isinstance(v, Rowset):
+			self.rowset(v)
+		else:
+			raise TypeError("can't pack %s objects" % type(v).__name__)
+
+	def element(self, e):
+		ref = self.elements.get(id(e))
+		if ref is not None:
+			self.write(b"r" + _u32.pack(ref))
+			return
+		self.elements[id(e)] = len(self.elements)
+		self._keep.append(e)
+
+		lazy = e.__dict__.get("_lazy")
+		if lazy:
+			for attr in list(lazy):
+				getattr(e, attr)
+		attrs = [(k, v) for k, v in e.__dict__.items() if k not in ("_lazy", "_lazydoc")]
+		self.write(b"E" + _u32.pack(len(attrs)))
+		for k, v in attrs:
+			self.write(_u32.pack(self.string(k)))
+			self.value(v)
+
+	def rowset(self, rs):
+		kind = len(_rowsetKinds) - 1
+		while not isinstance(rs, _rowsetKinds[kind]):
+			kind -= 1
+		ncols = len(rs._cols)
+		if isinstance(rs, ColumnarRowset):
+			columns = rs._rows.columns
+		else:
+			rows = rs._rows
+			try:
+				columns = [list(map(operator.itemgetter(i), rows)) for i in range(ncols)]
+			except IndexError:
+				# some rows are shorter than the columns.
+				columns = [[_RowValue(row, i) for row in rows] for i in range(ncols)]
+
+		self.write(b"R" + struct.pack("<BII", kind, ncols, len(rs)))
+		for column in rs._cols:
+			self.write(_u32.pack(self.string(column)))
+		if isinstance(rs, IndexRowset):
+			self.write(_u32.pack(self.string(rs._key)))
+		self.value(getattr(rs, "_name", None))
+
+		indexes = getattr(rs, "_indexes", None) or {}
+		self.write(_u32.pack(len(indexes)))
+		for name, index in indexes.items():
+			self.write(struct.pack("<IBBI", self.string(name), index.unique, index.ordered, len(index.columns)))
+			self.write(struct.pack("<%dI" % len(index.columns), *index.columns))
+
+		for col in columns:
+			self.column(col)
+
+		if isinstance(rs, IndexRowset):
+			order = None
+			if self.keyOrder:
+				if rs.composite:
+					keys = list(zip(*[columns[i] for i in rs._ki]))
+				else:
+					keys = columns[rs._ki]
+				try:
+					order = sorted(range(len(keys)), key=keys.__getitem__)
+				except TypeError:
+					pass  # keys of mixed types.
+			if order is None:
+				self.write(b"\0")
+			else:
+				self.write(b"\1")
+				self.array(None, array.array("i", order))
+
+	def column(self, col):
+		# tags: q int64 array, d float64 array, c distinct values and their
+		# codes, S string indexes, v tagged values.
+		if isinstance(col, _arrayTypes):
+			self.array("d" if _typecode(col) == "d" else "q", col)
+		elif isinstance(col, _DictColumn):
+			if not isinstance(col.values, list):
+				# refers to the string table of a frozen file; only write
+				# the values used.
+				col = col.take(range(len(col)))
+			self.write(b"c")
+			self.value(col.values)
+			self.array(None, col.codes)
+		else:
+			types = set(map(type, col))
+			if types and types <= _intTypes and -2**63 <= min(col) and max(col) < 2**63:
+				self.array("q", array.array(_int64, col))
+			elif types == set([float]):
+				self.array("d", array.array("d", col))
+			elif types and types <= _stringTypes:
+				self.write(b"S")
+				strings = self.strings
+				if str is bytes:
+					col = [s.decode("utf-8") if isinstance(s, bytes) else s for s in col]
+				self.array(None, array.array("i", [strings.setdefault(s, len(strings)) for s in col]))
+			else:
+				self.values(col)
+
+	def values(self, col):
+		lookup = {}
+		try:
+			codes = [lookup.setdefault((type(v), v), len(lookup)) for v in col]
+		except TypeError:
+			codes = None  # unhashable values.
+		if codes is not None and len(lookup) <= len(col) // 2:
+			self.write(b"c")
+			self.value([v for t, v in sorted(lookup, key=lookup.get)])
+			self.array(None, array.array("i", codes))
+		else:
+			self.write(b"v")
+			for value in col:
+				self.value(value)
+
+	def array(self, tag, col):
+		# writes an array column, or the codes of one if tag is None.
+		if tag:
+			self.write(tag.encode("ascii"))
+		self.align()
+		if tag:
+			self.write(_ArrayBytes(col, tag))
+		elif _littleEndian:
+			self.write(col.tobytes() if hasattr(col, "tobytes") else col.tostring())
+		else:
+			self.write(struct.pack("<%di" % len(col), *col))
+
+	def getvalue(self):
+		strings = self.strings
+		encoded = [s.encode("utf-8") for s in sorted(strings, key=strings.get)]
+		table = b"\0".join(encoded)
+		if strings and table.count(b"\0") != len(strings) - 1:
+			raise ValueError("can't pack strings containing NUL characters")
+		offsets = array.array("I", [0])
+		for data in encoded:
+			offsets.append(offsets[-1] + len(data) + 1)
+		if not _littleEndian:
+			offsets.byteswap()
+		offsets = offsets.tobytes() if hasattr(offsets, "tobytes") else offsets.tostring()
+
+		size = _binaryHeader.size + 4 + len(table)
+		chunks = [_u32.pack(len(table)), table, b"\0" * (-size % 4), offsets]
+		size += -size % 4 + len(offsets)
+		chunks.append(b"\0" * (-size % 8))  # keeps the arrays in the body aligned.
+		size += -size % 8
+		return b"".join([_binaryHeader.pack(_binaryMagic, _binaryVersion, len(strings), size)] + chunks + self.chunks)
+
+
+class _MappedStrings(object):
+	# The string table of a frozen file, decoding strings when accessed.
+
+	def __init__(self, table, offsets):
+		self._table = table
+		self._offsets = offsets
+
+	def __len__(self):
+		return len(self._offsets) - 1
+
+	def __getitem__(self, i):
+		return self._table[self._offsets[i]:self._offsets[i+1]-1].tobytes().decode("utf-8")
+
+	def __iter__(self):
+		return map(self.__getitem__, range(len(self)))
+
+
+class _BinaryReader(object):
+	# Loads an object written by _BinaryWriter from a bytes-like object. If
+	# mapped, arrays and strings are not copied but read from the data when
+	# they are accessed, and rowsets are read-only columnar rowsets.
+
+	def __init__(self, data, mapped=False):
+		self.data = data = memoryview(data)
+		if len(data) < _binaryHeader.size:
+			raise ValueError("not a packed eveapi result")
+		magic, version, count, start = _binaryHeader.unpack_from(data, 0)
+		if magic != _binaryMagic:
+			raise ValueError("not a packed eveapi result")
+		if version > _binaryVersion:
+			raise ValueError("unsupported packed result version %d" % version)
+
+		self.version = version
+		self.mapped = mapped
+		self.views = mapped and _littleEndian and hasattr(data, "cast")
+		pos = _binaryHeader.size
+		size = _u32.unpack_from(data, pos)[0]
+		if self.views and version >= 2:
+			pos += 4 + size
+			pos += -pos % 4
+			self.strings = _MappedStrings(data[_binaryHeader.size+4:], data[pos:pos+4*(count+1)].cast("I"))
+		else:
+			self.strings = data[pos+4:pos+4+size].tobytes().decode("utf-8").split(u"\0") if count else []
+		self.pos = start
+		self.elements = []
+		self._values = {
+			b"N": lambda: None,
+			b"T": lambda: True,
+			b"F": lambda: False,
+			b"i": lambda: self.unpack(_i64),
+			b"l": lambda: int(self.string()),
+			b"D": lambda: decimal.Decimal(self.string()),
+			b"d": lambda: self.unpack(_f64),
+			b"s": self.string,
+			b"[": lambda: [self.value() for i in range(self.unpack(_u32))],
+			b"(": lambda: tuple([self.value() for i in range(self.unpack(_u32))]),
+			b"E": self.element,
+			b"r": lambda: self.elements[self.unpack(_u32)],
+			b"R": self.rowset,
+		}
+
+	def unpack(self, st):
+		value = st.unpack_from(self.data, self.pos)[0]
+		self.pos += st.size
+		return value
+
+	def tag(self):
+		self.pos += 1
+		return self.data[self.pos-1:self.pos].tobytes()
+
+	def align(self):
+		self.pos += -self.pos % 8
+
+	def string(self):
+		return self.strings[self.unpack(_u32)]
+
+	def value(self):
+		tag = self.tag()
+		try:
+			read = self._values[tag]
+		except KeyError:
+			raise ValueError("corrupt packed result (tag %r at %d)" % (tag, self.pos - 1))
+		return read()
+
+	def element(self):
+		e = Element()
+		self.elements.append(e)
+		attrs = e.__dict__
+		for i in range(self.unpack(_u32)):
+			name = self.string()
+			attrs[name] = self.value()
+		return e
+
+	def rowset(self):
+		kind, ncols, length = struct.unpack_from("<BII", self.data, self.pos)
+		self.pos += 9
+		cls = _rowsetKinds[kind]
+		cols = [self.string() for i in range(ncols)]
+		key = self.string() if issubclass(cls, IndexRowset) else None
+		name = self.value() if self.version >= 3 else None
+
+		indexes = {}
+		for i in range(self.unpack(_u32)):
+			name, unique, ordered, n = struct.unpack_from("<IBBI", self.data, self.pos)
+			self.pos += 10
+			columns = list(struct.unpack_from("<%dI" % n, self.data, self.pos))
+			self.pos += 4 * n
+			indexes[self.strings[name]] = _RowsetIndex(columns, bool(unique), bool(ordered))
+
+		store = _ColumnStore([self.column(length) for i in range(ncols)], length)
+		order = None
+		if key is not None and self.version >= 2 and self.tag() == b"\1":
+			self.align()
+			order = self.array("i", length)
+
+		if self.mapped:
+			store.readonly = True
+			if key is None:
+				rs = ColumnarRowset(cols, store)
+			elif order is None:
+				rs = ColumnarIndexRowset(cols, store, key)
+			else:
+				rs = FrozenIndexRowset(cols, store, key, order)
+		elif issubclass(cls, ColumnarRowset):
+			rs = cls(cols, store, key) if key is not None else cls(cols, store)
+		else:
+			rows = list(store) if length else []
+			rs = cls(cols, rows, key) if key is not None else cls(cols, rows)
+		if name is not None:
+			rs._name = name
+		if indexes:
+			rs._indexes = indexes
+		return rs
+
+	def array(self, typecode, length):
+		# reads an array of given length.
+		col = array.array(typecode)
+		size = length * col.itemsize
+		if self.views and col.itemsize == struct.calcsize(typecode):
+			col = self.data[self.pos:self.pos+size].cast(typecode)
+			self.pos += size
+			return col
+		if _littleEndian:
+			frombytes = getattr(col, "frombytes", None) or col.fromstring
+			frombytes(self.data[self.pos:self.pos+size].tobytes())
+		else:
+			col.extend(struct.unpack_from("<%d%s" % (length, "q" if typecode == _int64 else typecode), self.data, self.pos))
+		self.pos += size
+		return col
+
+	def column(self, length):
+		tag = self.tag()
+		if tag == b"q" or tag == b"d":
+			self.align()
+			return self.array(_int64 if tag == b"q" else "d", length)
+		if tag == b"c":
+			col = _DictColumn()
+			col.values = values = self.value()
+			col._lookup = dict(((type(v), v), code) for code, v in enumerate(values))
+			self.align()
+			col.codes = self.array("i", length)
+			return col
+		if tag == b"S":
+			self.align()
+			if self.mapped:
+				col = _DictColumn(self.strings)
+				col.codes = self.array("i", length)
+				return col
+			return list(map(self.strings.__getitem__, self.array("i", length)))
+		if tag == b"v":
+			return [self.value() for i in range(length)]
+		raise ValueError("corrupt packed result (column tag %r at %d)" % (tag, self.pos - 1))
+
+
+def PackResult(obj, keyOrder=False):
+	# Returns an API result, Element or Rowset in the binary format. With
+	# keyOrder, the key order of IndexRowsets is included (see OpenFrozen).
+	writer = _BinaryWriter(keyOrder)
+	writer.value(obj)
+	return writer.getvalue()
+
+def UnpackResult(data):
+	# Returns the object packed in data by PackResult(). data can be any
+	# bytes-like object, such as a mmap.
+	reader = _BinaryReader(data)
+	try:
+		return reader.value()
+	finally:
+		if hasattr(reader.data, "release"):
+			reader.data.release()
+
+def SaveResult(obj, filename, keyOrder=False):
+	# Packs obj into given file (atomically).
+	data = PackResult(obj, keyOrder)
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+		_replace(tmp, filename)
+	except:
+		os.remove(tmp)
+		raise
+
+def LoadResult(filename):
+	# Loads an object saved with SaveResult(), reading it through a memory
+	# map of the file.
+	with open(filename, "rb") as f:
+		m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		return UnpackResult(m)
+	finally:
+		m.close()
+
+def FreezeResult(obj, filename):
+	# Saves obj (typically a large result that rarely changes, such as
+	# eve/SkillTree or map/Sovereignty) for use with OpenFrozen().
+	SaveResult(obj, filename, keyOrder=True)
+
+def OpenFrozen(filename):
+	# Opens a file written by FreezeResult() without loading its contents.
+	# Returns the saved object with read-only columnar rowsets whose columns
+	# (and strings) are read from a memory map of the file when accessed.
+	# Processes that open the same file share the memory it takes in the
+	# page cache, instead of each holding a copy of the data. IndexRowsets
+	# become FrozenIndexRowsets. The file is closed when the object and
+	# all rowsets taken from it are gone. Requires Python 3 for sharing
+	# the data; elsewhere the columns are loaded into memory.
+	with open(filename, "rb") as f:
+		m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	return _BinaryReader(m, True).value()
+
+
+
+#-----------------------------------------------------------------------------
+# Cache Handlers
+#-----------------------------------------------------------------------------
+# Ready-made cache handlers that can be passed as cacheHandler to
+# EVEAPIConnection. See EVEAPIConnection for the handler interface.
+#-----------------------------------------------------------------------------
+
+# os.replace() is atomic on all platforms, but does not exist on Python 2.
+_replace = getattr(os, "replace", os.rename)
+
+def _CacheKey(host, path, params):
+	# returns a hashable key identifying an API request.
+	return (host, path, tuple(sorted(params.items())))
+
+def _CacheHash(key):
+	# returns a stable hex digest for a key produced by _CacheKey, suitable
+	# for use as a file name or database key.
+	return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+def _CacheExpiry(obj):
+	# returns the local time at which the document that produced obj should
+	# be considered stale. cachedUntil is expressed in server time, so it is
+	# converted using the server's currentTime.
+	return time.time() + (obj.cachedUntil - obj.currentTime)
+
+
+class MemoryCacheHandler(object):
+	# A thread-safe in-memory cache handler that holds on to the XML
+	# documents until their cachedUntil time has passed.
+	#
+	# The cache is bounded by both the number of documents (maxEntries) and
+	# the total size of the documents in bytes (maxBytes). When either limit
+	# is exceeded, expired documents are evicted first, then documents are
+	# evicted in least recently used order.
+	#
+	# Expired documents are kept for another keepStale seconds (space
+	# permitting), during which they are available through retrieve_stale()
+	# for the staleWhileRevalidate and staleIfError policies of
+	# EVEAPIConnection.
+
+	def __init__(self, maxEntries=1000, maxBytes=64*1024*1024, keepStale=3600):
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.keepStale = keepStale
+		self._entries = OrderedDict()  # key -> (expires, doc, size), LRU first
+		self._expiry = []  # heap of (expires, seq, key)
+		self._seq = 0
+		self._size = 0
+		self._lock = threading.Lock()
+
+	def __bool__(self):
+		# an empty cache is still a cache.
+		return True
+
+	def __len__(self):
+		return len(self._entries)
+
+	def retrieve(self, host, path, params):
+		return self._get(_CacheKey(host, path, params), False)
+
+	def retrieve_stale(self, host, path, params):
+		return self._get(_CacheKey(host, path, params), True)
+
+	def store(self, host, path, params, doc, obj):
+		self._put(_CacheKey(host, path, params), doc, len(doc), _CacheExpiry(obj))
+
+	def _get(self, key, stale):
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry is None:
+				return None
+			now = time.time()
+			if entry[0] + self.keepStale <= now:
+				self._size -= entry[2]
+				return None
+			# reinsert to mark it most recently used.
+			self._entries[key] = entry
+			if entry[0] <= now and not stale:
+				return None
+			return entry[1]
+
+	def _put(self, key, value, size, expires):
+		if expires <= time.time() or size > self.maxBytes:
+			return
+
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self._size -= old[2]
+			self._entries[key] = (expires, value, size)
+			self._size += size
+			self._seq += 1
+			heapq.heappush(self._expiry, (expires, self._seq, key))
+			self._evict()
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._expiry = []
+			self._size = 0
+
+	def _evict(self):
+		# must be called with the lock held.
+		entries = self._entries
+		heap = self._expiry
+
+		# documents past their stale period go unconditionally, other
+		# expired documents go first if we're over the limits.
+		now = time.time()
+		while heap and heap[0][0] <= now:
+			if heap[0][0] + self.keepStale > now and len(entries) <= self.maxEntries and self._size <= self.maxBytes:
+				break
+			expires, seq, key = heapq.heappop(heap)
+			entry = entries.get(key)
+			if entry is not None and entry[0] == expires:
+				del entries[key]
+				self._size -= entry[2]
+
+		# then the least recently used ones.
+		while entries and (len(entries) > self.maxEntries or self._size > self.maxBytes):
+			key = next(iter(entries))
+			self._size -= entries.pop(key)[2]
+
+		# the expiry heap is cleaned up lazily; rebuild it if it's mostly
+		# made up of references to documents that are no longer cached.
+		if len(heap) > 2 * len(entries) + 64:
+			self._expiry = heap = []
+			for key, entry in entries.items():
+				self._seq += 1
+				heap.append((entry[0], self._seq, key))
+			heapq.heapify(heap)
+
+
+class TieredCacheHandler(MemoryCacheHandler):
+	# A two-tier cache handler. The first tier is a MemoryCacheHandler that
+	# holds the parsed objects rather than the XML documents, so a hit in
+	# this tier does not have to parse anything at all. The second tier
+	# keeps the zlib-compressed XML documents on disk, in directory. Disk
+	# hits are parsed once and promoted to the memory tier.
+	#
+	# maxEntries, maxBytes and keepStale work as they do for
+	# MemoryCacheHandler. Sizes are measured by the length of the XML
+	# documents the objects were parsed from.
+	#
+	# IMPORTANT: objects returned from the memory tier are shared between
+	# all callers requesting the same document, so they must be treated as
+	# read-only (as is the case for all objects returned by API calls). Make
+	# a copy (copy.deepcopy) of any part of a result you intend to modify.
+
+	def __init__(self, directory=None, maxEntries=1000, maxBytes=64*1024*1024, keepStale=3600):
+		MemoryCacheHandler.__init__(self, maxEntries, maxBytes, keepStale)
+		self.directory = directory or os.path.join(tempfile.gettempdir(), "eveapi")
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory)
+
+	def _filename(self, key):
+		return os.path.join(self.directory, _CacheHash(key) + ".cache")
+
+	def retrieve(self, host, path, params):
+		return self._lookup(_CacheKey(host, path, params), False)
+
+	def retrieve_stale(self, host, path, params):
+		return self._lookup(_CacheKey(host, path, params), True)
+
+	def _lookup(self, key, stale):
+		obj = self._get(key, stale)
+		if obj is not None:
+			return obj
+
+		filename = self._filename(key)
+		try:
+			with open(filename, "rb") as f:
+				expires, data = f.read().split(b"\n", 1)
+			expires = float(expires)
+		except (IOError, OSError):
+			return None
+		except ValueError:
+			# damaged file.
+			self._remove(filename)
+			return None
+
+		now = time.time()
+		if expires + self.keepStale <= now:
+			self._remove(filename)
+			return None
+		if expires <= now and not stale:
+			return None
+
+		try:
+			doc = zlib.decompress(data)
+			obj = _Parser().Parse(doc, False, key[1])
+		except (zlib.error, expat.ExpatError, ValueError):
+			# damaged file (e.g. truncated by a crash); treat it as a miss
+			# so the document is fetched and stored again.
+			self._remove(filename)
+			return None
+		self._put(key, obj, len(doc), expires)
+		return obj
+
+	def store(self, host, path, params, doc, obj):
+		key = _CacheKey(host, path, params)
+		expires = _CacheExpiry(obj)
+		self._put(key, obj, len(doc), expires)
+
+		if expires > time.time():
+			if not isinstance(doc, bytes):
+				doc = doc.encode("utf-8")
+			# write to a temporary file first so that readers never see a
+			# partially written document.
+			filename = self._filename(key)
+			fd, tmpname = tempfile.mkstemp(dir=self.directory)
+			try:
+				with os.fdopen(fd, "wb") as f:
+					f.write(("%.3f\n" % expires).encode("ascii"))
+					f.write(zlib.compress(doc))
+				_replace(tmpname, filename)
+			except (IOError, OSError):
+				self._remove(tmpname)
+
+	def purge(self):
+		# removes all documents past their stale period from the disk tier.
+		now = time.time()
+		for name in os.listdir(self.directory):
+			if name.endswith(".cache"):
+				filename = os.path.join(self.directory, name)
+				try:
+					with open(filename, "rb") as f:
+						expires = float(f.readline())
+				except (IOError, OSError, ValueError):
+					continue
+				if expires + self.keepStale <= now:
+					self._remove(filename)
+
+	def _remove(self, filename):
+		try:
+			os.remove(filename)
+		except OSError:
+			pass
+
+
+class SQLiteCacheHandler(object):
+	# A persistent cache handler that stores zlib-compressed XML documents in
+	# an SQLite database. The database runs in WAL mode, so it can be shared
+	# by several processes (and threads) on the same machine.
+	#
+	# Documents are keyed on a hash of the request's host, path and
+	# parameters. Expired documents are kept around for another keepStale
+	# seconds, during which they can still be served by retrieve_fallback()
+	# when the API server reports an error, or through retrieve_stale() for
+	# the staleWhileRevalidate and staleIfError policies of EVEAPIConnection.
+	# After that they are deleted in bulk by a background thread that runs
+	# every purgeInterval seconds (0 disables the thread; call purge()
+	# yourself in that case).
+
+	def __init__(self, filename, keepStale=3600, purgeInterval=300):
+		self.filename = filename
+		self.keepStale = keepStale
+		self._local = threading.local()
+
+		db = self._db()
+		with db:
+			db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, cachedUntil REAL NOT NULL, doc BLOB NOT NULL)")
+			db.execute("CREATE INDEX IF NOT EXISTS cache_cachedUntil ON cache (cachedUntil)")
+
+		self._stop = threading.Event()
+		if purgeInterval:
+			t = threading.Thread(target=self._purger, args=(purgeInterval,))
+			t.daemon = True
+			t.start()
+
+	def _db(self):
+		# sqlite connections can't be shared between threads, so every
+		# thread gets its own.
+		db = getattr(self._local, "db", None)
+		if db is None:
+			db = self._local.db = sqlite3.connect(self.filename, timeout=30)
+			db.execute("PRAGMA journal_mode=WAL")
+			db.execute("PRAGMA synchronous=NORMAL")
+		return db
+
+	def _purger(self, interval):
+		while not self._stop.wait(interval):
+			try:
+				self.purge()
+			except sqlite3.Error:
+				pass
+
+	def _get(self, host, path, params, stale):
+		key = _CacheHash(_CacheKey(host, path, params))
+		now = time.time()
+		if stale:
+			now -= self.keepStale
+		row = self._db().execute("SELECT doc FROM cache WHERE key=? AND cachedUntil>?", (key, now)).fetchone()
+		if row is None:
+			return None
+		return zlib.decompress(bytes(row[0]))
+
+	def retrieve(self, host, path, params):
+		return self._get(host, path, params, False)
+
+	def retrieve_stale(self, host, path, params):
+		return self._get(host, path, params, True)
+
+	def store(self, host, path, params, doc, obj):
+		if not isinstance(doc, bytes):
+			doc = doc.encode("utf-8")
+		key = _CacheHash(_CacheKey(host, path, params))
+		db = self._db()
+		with db:
+			db.execute("INSERT OR REPLACE INTO cache (key, cachedUntil, doc) VALUES (?, ?, ?)", (key, _CacheExpiry(obj), sqlite3.Binary(zlib.compress(doc))))
+
+	def retrieve_fallback(self, host, path, params, reason):
+		# serve the last known good document, even if it expired.
+		doc = self._get(host, path, params, True)
+		if doc is None:
+			return None
+		try:
+			return _ParseXML(doc, True, None, path)
+		except Error:
+			return None
+
+	def purge(self):
+		# deletes all documents that expired more than keepStale seconds ago.
+		db = self._db()
+		with db:
+			db.execute("DELETE FROM cache WHERE cachedUntil<=?", (time.time() - self.keepStale,))
+
+	def close(self):
+		# stops the purge thread and closes the calling thread's connection.
+		self._stop.set()
+		db = getattr(self._local, "db", None)
+		if db is not None:
+			db.close()
+			self._local.db = None
+
+
+
+#-----------------------------------------------------------------------------
+# Rate Limiting
+#-----------------------------------------------------------------------------
+
+class RateLimiter(object):
+	# A thread-safe token bucket rate limiter for API requests, to be passed
+	# as rateLimiter to EVEAPIConnection or AsyncEVEAPIConnection.
+	#
+	# rate     - sustained number of requests per second allowed per host.
+	# burst    - number of requests per host that may be sent at once before
+	#            rate kicks in. Defaults to rate.
+	# keyRate  - if given, additionally limits the number of requests per
+	#            second made with any single API key (keyID).
+	# keyBurst - burst size for the per-key limit. Defaults to keyRate.
+	#
+	# Requests exceeding the limits are delayed (never rejected) until they
+	# fit. stats() reports how much delaying is going on.
+
+	def __init__(self, rate=30, burst=None, keyRate=None, keyBurst=None):
+		self.rate = float(rate)
+		self.burst = burst or max(1, int(rate))
+		self.keyRate = keyRate and float(keyRate)
+		self.keyBurst = keyBurst or max(1, int(keyRate or 1))
+		# the buckets are implemented as "virtual scheduling" (GCRA): for
+		# every host and key only the time at which the bucket would be
+		# full again is kept.
+		self._hosts = {}
+		self._keys = {}
+		self._pending = []  # heap of send times of delayed requests
+		self._lock = threading.Lock()
+		self._requests = 0
+		self._delayed = 0
+		self._totalWait = 0.0
+		self._maxWait = 0.0
+
+	def _allowed(self, buckets, key, rate, burst, now):
+		# returns the earliest time a request may be sent through a bucket.
+		return max(now, buckets.get(key, now) - (burst - 1) / rate)
+
+	def _take(self, buckets, key, rate, when, now):
+		buckets[key] = max(buckets.get(key, now), when) + 1 / rate
+
+	def reserve(self, host, keyID=None):
+		# reserves a slot for a request and returns the number of seconds
+		# the caller has to wait before sending it.
+		now = time.time()
+		with self._lock:
+			when = self._allowed(self._hosts, host, self.rate, self.burst, now)
+			if keyID is not None and self.keyRate:
+				when = max(when, self._allowed(self._keys, keyID, self.keyRate, self.keyBurst, now))
+				self._take(self._keys, keyID, self.keyRate, when, now)
+				if len(self._keys) > 4096:
+					# forget keys whose buckets have filled up again.
+					self._keys = dict((k, t) for k, t in self._keys.items() if t > now)
+			self._take(self._hosts, host, self.rate, when, now)
+
+			wait = when - now
+			self._requests += 1
+			self._expire(now)
+			if wait > 0:
+				self._delayed += 1
+				self._totalWait += wait
+				self._maxWait = max(self._maxWait, wait)
+				heapq.heappush(self._pending, when)
+		return wait
+
+	def _expire(self, now):
+		# drops the requests that have been sent by now, so that _pending
+		# only holds those still waiting. Must be called with the lock held.
+		pending = self._pending
+		while pending and pending[0] <= now:
+			heapq.heappop(pending)
+
+	def acquire(self, host, keyID=None):
+		# blocks until a request may be sent.
+		wait = self.reserve(host, keyID)
+		if wait > 0:
+			time.sleep(wait)
+
+	def stats(self):
+		# returns a dict with the following metrics:
+		#   requests  - total number of requests seen.
+		#   delayed   - number of those that had to wait.
+		#   queued    - number of requests currently waiting.
+		#   totalWait - total number of seconds spent waiting.
+		#   maxWait   - longest wait of a single request, in seconds.
+		#   meanWait  - average wait per request, in seconds.
+		now = time.time()
+		with self._lock:
+			self._expire(now)
+			return {
+				"requests": self._requests,
+				"delayed": self._delayed,
+				"queued": len(self._pending),
+				"totalWait": self._totalWait,
+				"maxWait": self._maxWait,
+				"meanWait": self._totalWait / self._requests if self._requests else 0.0,
+			}
+
+
+
+#-----------------------------------------------------------------------------
+# Background Refresh
+#-----------------------------------------------------------------------------
+
+class RefreshScheduler(object):
+	# Keeps API data warm by calling registered API functions again shortly
+	# after the data they returned last time has expired (as indicated by
+	# the cachedUntil time of the result). With a cache handler attached to
+	# the connection, this keeps the cache populated; optional callbacks
+	# receive every new result.
+	#
+	# delay      - seconds to wait after cachedUntil before refreshing.
+	# jitter     - up to this many seconds of random extra delay are added to
+	#              every refresh, so that many registered calls expiring at
+	#              the same time don't all hit the API server at once.
+	# retryDelay - seconds to wait before retrying a call that failed.
+	# workers    - number of threads performing refreshes after start().
+	#
+	# Example:
+	#
+	#   scheduler = RefreshScheduler()
+	#   me = auth.character(characterID)
+	#   scheduler.register(me.WalletJournal, callback=process, accountKey=1000)
+	#   scheduler.start()
+	#
+	# Registered calls are first performed after a random delay of at most
+	# jitter seconds. Instead of start()ing the worker threads, you can also
+	# call run_pending() periodically from your own loop.
+
+	def __init__(self, delay=5, jitter=60, retryDelay=300, workers=4):
+		self.delay = delay
+		self.jitter = jitter
+		self.retryDelay = retryDelay
+		self.workers = workers
+		self._calls = {}  # handle -> (context, params, callback, errback)
+		self._heap = []  # (due, handle)
+		self._handle = 0
+		self._skew = None
+		self._cond = threading.Condition()
+		self._threads = []
+		self._running = False
+
+	def __len__(self):
+		return len(self._calls)
+
+	def register(self, context, callback=None, errback=None, **params):
+		# registers the API function context (for example
+		# auth.character(characterID).WalletJournal) to be called with the
+		# given parameters. callback is called with the result of every
+		# successful call, errback with the exception of every failed one.
+		# Returns a handle for unregister().
+		context._root._requireBlocking("RefreshScheduler")
+		with self._cond:
+			self._handle += 1
+			handle = self._handle
+			self._calls[handle] = (context, params, callback, errback)
+			self._schedule(handle, time.time() + random.uniform(0, self.jitter))
+		return handle
+
+	def unregister(self, handle):
+		with self._cond:
+			self._calls.pop(handle, None)
+
+	def _schedule(self, handle, due):
+		# must be called with the lock held.
+		heapq.heappush(self._heap, (due, handle))
+		self._cond.notify()
+
+	def _next(self, now):
+		# pops the next due call, if any. Must be called with the lock held.
+		while self._heap and self._heap[0][0] <= now:
+			due, handle = heapq.heappop(self._heap)
+			if handle in self._calls:
+				return handle
+		return None
+
+	def _refresh(self, handle):
+		with self._cond:
+			call = self._calls.get(handle)
+		if call is None:
+			return
+		context, params, callback, errback = call
+		try:
+			result = context(**params)
+		except Exception as e:
+			with self._cond:
+				if handle in self._calls:
+					self._schedule(handle, time.time() + self.retryDelay + random.uniform(0, self.jitter))
+			if errback:
+				errback(e)
+			return
+
+		meta = result._meta
+		with self._cond:
+			# cachedUntil is expressed in server time. The server clock's
+			# offset is estimated from the freshest result seen so far, as
+			# results served from a cache carry an older currentTime.
+			skew = time.time() - meta.currentTime
+			if self._skew is None or skew < self._skew:
+				self._skew = skew
+			if handle in self._calls:
+				self._schedule(handle, meta.cachedUntil + self._skew + self.delay + random.uniform(0, self.jitter))
+
+		if callback:
+			callback(result)
+
+	def run_pending(self):
+		# performs all calls that are due, in the calling thread. Exceptions
+		# raised by callbacks are passed on to the caller.
+		while True:
+			with self._cond:
+				handle = self._next(time.time())
+			if handle is None:
+				return
+			self._refresh(handle)
+
+	def _worker(self):
+		while True:
+			with self._cond:
+				while True:
+					if not self._running:
+						return
+					now = time.time()
+					handle = self._next(now)
+					if handle is not None:
+						break
+					self._cond.wait(self._heap[0][0] - now if self._heap else None)
+			try:
+				self._refresh(handle)
+			except Exception as e:
+				# a failing callback must not stop the worker.
+				warnings.warn("RefreshScheduler callback raised %s: %s" % (type(e).__name__, e), RuntimeWarning)
+
+	def start(self):
+		# starts the worker threads.
+		with self._cond:
+			if self._running:
+				return
+			self._running = True
+			self._threads = [threading.Thread(target=self._worker) for i in range(self.workers)]
+		for t in self._threads:
+			t.daemon = True
+			t.start()
+
+	def stop(self):
+		# stops the worker threads, waiting for any refreshes in progress.
+		with self._cond:
+			self._running = False
+			self._cond.notify_all()
+		for t in self._threads:
+			t.join()
+		self._threads = []
+
+
+#-----------------------------------------------------------------------------
+# Pagination
+#-----------------------------------------------------------------------------
+
+def _ResultRowset(result, name, path):
+	# returns the named rowset of an API result, or its first rowset.
+	if name:
+		names = [name]
+	else:
+		names = list(result.__dict__.get("_lazy") or ()) + list(result.__dict__)
+	for attr in names:
+		value = getattr(result, attr, None)
+		if isinstance(value, Rowset):
+			return value
+	raise ValueError("%s result has no rowset %s" % (path, name or ""))
+
+class Pager(object):
+	# Walks the pages of a journal type API function, such as WalletJournal
+	# and WalletTransactions. These return at most rowCount rows, newest
+	# first, and return the rows before a given ID when passed that as
+	# fromID. The pager requests pages going back in time until there are
+	# no more rows, or until it reaches the row with ID stopID.
+	#
+	# context  - the API function to call, for example
+	#            auth.character(characterID).WalletJournal.
+	# rowset   - name of the rowset in the result to walk. Defaults to the
+	#            first rowset found.
+	# key      - name of the ID column. Defaults to the key of the rowset.
+	# rowCount - number of rows to request per page.
+	# stopID   - if set, rows with this or a lower ID are not returned, and
+	#            no pages beyond them are requested. Use the highestID of a
+	#            previous walk to only fetch new rows.
+	# prefetch - if True, the next page is requested on another thread
+	#            while the caller processes the current one.
+	# Any further keyword arguments are passed to every call, for example
+	# accountKey.
+	#
+	# Iterating over a Pager performs the walk, yielding a rowset of the new
+	# rows of each page. Rows seen on an earlier page are skipped, which
+	# happens when rows are added while walking. A walk also ends on a page
+	# that has no new rows. Example:
+	#
+	#   pager = Pager(me.WalletJournal, accountKey=1000)
+	#   for page in pager:
+	#       process(page)
+	#
+	#   entries = me.WalletJournal.pages(stopID=lastRefID).collect()
+	#
+	# After a walk, highestID holds the highest ID seen, and result the last
+	# result returned by the API.
+
+	def __init__(self, context, rowset=None, key=None, rowCount=2560, stopID=None, prefetch=False, **params):
+		context._root._requireBlocking("Pager")
+		self.context = context
+		self.rowset = rowset
+		self.key = key
+		self.rowCount = rowCount
+		self.stopID = stopID
+		self.prefetch = prefetch
+		self.params = params
+		self.highestID = None
+		self.result = None
+
+	def collect(self):
+		# performs the walk and returns all new rows merged into a single
+		# rowset, indexed on the ID column.
+		merged = None
+		for page in self:
+			if merged is None:
+				merged = page[:]
+				if not isinstance(merged, IndexRowset):
+					merged = merged.IndexedBy(self._key(page))
+			else:
+				for row in page._rows:
+					merged.append(row)
+		return merged
+
+	def __iter__(self):
+		seen = set()
+		stopID = self.stopID
+		pending = self._request(None)
+		while pending:
+			self.result = result = pending()
+			rowset = self._rowset(result)
+			key = self._key(rowset)
+			ids = list(rowset.Select(key))
+
+			page = rowset.Where(key, lambda id, seen: id not in seen and (stopID is None or id > stopID), seen)
+			new = list(page.Select(key))
+			seen.update(new)
+			if new and (self.highestID is None or max(new) > self.highestID):
+				self.highestID = max(new)
+
+			# the next page is requested before this one is handed to the
+			# caller, so that it can be prefetched.
+			lowest = min(ids) if ids else None
+			if not new or len(ids) < self.rowCount or (stopID is not None and lowest <= stopID):
+				pending = None
+			else:
+				pending = self._request(lowest)
+			yield page
+
+	def _request(self, fromID):
+		# starts requesting a page, returns a function that returns it.
+		kw = dict(self.params)
+		kw["rowCount"] = self.rowCount
+		if fromID is not None:
+			kw["fromID"] = fromID
+		if not self.prefetch:
+			return lambda: self.context(**kw)
+
+		call = _Flight()
+		def fetch():
+			try:
+				call.result = self.context(**kw)
+			except Exception as e:
+				call.error = e
+			finally:
+				call.event.set()
+
+		t = threading.Thread(target=fetch)
+		t.daemon = True
+		t.start()
+
+		def wait():
+			call.event.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result
+		return wait
+
+	def _rowset(self, result):
+		return _ResultRowset(result, self.rowset, self.context._path)
+
+	def _key(self, rowset):
+		key = self.key or getattr(rowset, "_key", None)
+		if not key or "," in key:
+			raise ValueError("%s rowset has no single column key, specify one" % self.context._path)
+		return key
+
+
+#-----------------------------------------------------------------------------
+# Delta Sync
+#-----------------------------------------------------------------------------
+
+def _FlattenRowset(rowset, key, parentID=None, flat=None):
+	# returns the rows of rowset and the rowsets nested in them (such as the
+	# contents of containers in AssetList) as a single IndexRowset on key,
+	# with the key of the row they were nested in added as parentID.
+	if flat is None:
+		nested = set()
+		for row in rowset._rows:
+			nested.update(c for c, v in zip(rowset._cols, row) if isinstance(v, Rowset))
+		flat = IndexRowset([c for c in rowset._cols if c not in nested] + ["parentID"], None, key)
+	cols = flat._cols
+	for row in rowset:
+		values = dict(zip(row._cols, row._row))
+		flat.append([values.get(c) for c in cols[:-1]] + [parentID])
+		for value in row._row:
+			if isinstance(value, Rowset):
+				_FlattenRowset(value, key, values[key], flat)
+	return flat
+
+
+class DeltaSync(object):
+	# Keeps track of what was fetched from the API before, so that every
+	# sync only returns what is new or changed. Its state is kept in an
+	# SQLite database, per API function, keyID, characterID and accountKey.
+	#
+	# new_rows(context, rowset=None, key=None, **params)
+	#   For journal type API functions (such as WalletJournal and
+	#   WalletTransactions). Walks the pages of the function with a Pager
+	#   (see Pager for the arguments) until it reaches the highest ID seen
+	#   in the previous sync, and returns the new rows as an IndexRowset.
+	#   The first sync returns all rows the API provides.
+	#
+	# changes(context, rowset=None, key="itemID", **params)
+	#   For API functions that return a complete list every time, such as
+	#   AssetList. Returns (added, changed, removed) IndexRowsets with the
+	#   rows that are new, differ from, or are missing compared to the
+	#   previous sync. Rows of nested rowsets are included, with the ID of
+	#   the row they are nested in in a parentID column. changed holds the
+	#   new versions of the rows.
+	#
+	# reset(context, **params)
+	#   Forgets the state of given API function, so the next sync starts
+	#   over.
+	#
+	# The state is updated as soon as the results are returned, so results
+	# that could not be processed should be handled by the caller. Example:
+	#
+	#   sync = DeltaSync("sync.db")
+	#   me = auth.character(characterID)
+	#   entries = sync.new_rows(me.WalletJournal, accountKey=1000)
+	#   added, changed, removed = sync.changes(me.AssetList)
+
+	def __init__(self, filename, rowCount=2560, prefetch=False):
+		self.filename = filename
+		self.rowCount = rowCount
+		self.prefetch = prefetch
+		self._local = threading.local()
+
+		db = self._db()
+		with db:
+			db.execute("CREATE TABLE IF NOT EXISTS marks (path TEXT, keyID TEXT, characterID TEXT, accountKey TEXT, highestID INTEGER NOT NULL, PRIMARY KEY (path, keyID, characterID, accountKey))")
+			db.execute("CREATE TABLE IF NOT EXISTS snapshots (path TEXT, keyID TEXT, characterID TEXT, accountKey TEXT, doc BLOB NOT NULL, PRIMARY KEY (path, keyID, characterID, accountKey))")
+
+	def _db(self):
+		# sqlite connections can't be shared between threads, so every
+		# thread gets its own.
+		db = getattr(self._local, "db", None)
+		if db is None:
+			db = self._local.db = sqlite3.connect(self.filename, timeout=30)
+			db.execute("PRAGMA journal_mode=WAL")
+		return db
+
+	def _key(self, context, params):
+		kw = dict(context.parameters)
+		kw.update(params)
+		return (context._path, str(_KeyID(kw) or ""), str(kw.get("characterID", "")), str(kw.get("accountKey", "")))
+
+	def new_rows(self, context, rowset=None, key=None, **params):
+		skey = self._key(context, params)
+		db = self._db()
+		row = db.execute("SELECT highestID FROM marks WHERE path=? AND keyID=? AND characterID=? AND accountKey=?", skey).fetchone()
+		pager = Pager(context, rowset, key, self.rowCount, row and row[0], self.prefetch, **params)
+		rows = pager.collect()
+		if pager.highestID is not None:
+			with db:
+				db.execute("INSERT OR REPLACE INTO marks VALUES (?, ?, ?, ?, ?)", skey + (pager.highestID,))
+		return rows
+
+	def changes(self, context, rowset=None, key="itemID", **params):
+		context._root._requireBlocking("DeltaSync")
+		skey = self._key(context, params)
+		current = _FlattenRowset(_ResultRowset(context(**params), rowset, context._path), key)
+
+		db = self._db()
+		row = db.execute("SELECT doc FROM snapshots WHERE path=? AND keyID=? AND characterID=? AND accountKey=?", skey).fetchone()
+		if row is None:
+			previous = IndexRowset(current._cols, None, key)
+		else:
+			previous = UnpackResult(zlib.decompress(bytes(row[0])))
+
+		doc = PackResult(current)
+		with db:
+			db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)", skey + (sqlite3.Binary(zlib.compress(doc)),))
+		return current.Diff(previous)
+
+	def reset(self, context, **params):
+		skey = self._key(context, params)
+		db = self._db()
+		with db:
+			for table in ("marks", "snapshots"):
+				db.execute("DELETE FROM %s WHERE path=? AND keyID=? AND characterID=? AND accountKey=?" % table, skey)
+
+	def close(self):
+		# closes the calling thread's connection.
+		db = getattr(self._local, "db", None)
+		if db is not None:
+			db.close()
+			self._local.db = None
@@ -0,0 +1,325 @@
+#-----------------------------------------------------------------------------
+# eveapi_async - asyncio client for the EVE Online API
+#
+# Copyright (c)2007-2014 Jamie "Entity" van den Berge <jamie@hlekkir.com>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE
+#
+#-----------------------------------------------------------------------------
+#
+# This module provides AsyncEVEAPIConnection, the asyncio counterpart of
+# eveapi.EVEAPIConnection. It supports the same attribute path magic, except
+# that calling an API function returns a coroutine:
+#
+#   api = AsyncEVEAPIConnection()
+#   auth = api.auth(keyID=..., vCode=...)
+#   journal = await auth.character(characterID).WalletJournal()
+#
+# Results are parsed by the eveapi module and are identical to the ones
+# returned by the blocking interface. Likewise, batch() returns a coroutine:
+#
+#   sheets = await auth.batch([(auth.character(id).CharacterSheet, None) ...])
+#
+# The helpers of the eveapi module that perform blocking calls themselves
+# can't be used with this client, and raise TypeError when given one of its
+# contexts: stream(), pages() and Pager, DeltaSync and RefreshScheduler.
+#
+# Requirements:
+#   Python 3.5+
+#
+#-----------------------------------------------------------------------------
+
+import asyncio
+import inspect
+import ssl
+import time
+import warnings
+
+import eveapi
+from eveapi import _RootContext, _NewRootContext, _ParseXML, _CheckStatus, _CacheKey, _KeyID, _serveStaleErrors, Error
+
+
+def AsyncEVEAPIConnection(url="api.eveonline.com", cacheHandler=None, proxy=None, proxySSL=False, poolSize=4, poolTimeout=30, coalesce=True, staleWhileRevalidate=False, staleIfError=False, rateLimiter=None, lazy=False, maxConcurrency=10):
+	# Creates an asyncio API object through which you can call remote
+	# functions.
+	#
+	# Takes the same arguments as eveapi.EVEAPIConnection, plus:
+	#
+	# maxConcurrency - maximum number of requests this connection will have
+	#                  in flight at any time. Further calls wait their turn.
+	#
+	# The cache handler interface is the same as the one described in
+	# eveapi.EVEAPIConnection, except that retrieve(), retrieve_stale(),
+	# store() and retrieve_fallback() may optionally be coroutines.
+	#
+
+	ctx = _NewRootContext(_AsyncRootContext, url, cacheHandler, proxy, proxySSL, rateLimiter)
+	ctx._pool = _AsyncConnectionPool(poolSize, poolTimeout)
+	ctx._flights = _AsyncSingleFlight() if coalesce else None
+	ctx._staleWhileRevalidate = staleWhileRevalidate
+	ctx._staleIfError = staleIfError
+	ctx._revalidating = {}
+	ctx._lazy = lazy
+	ctx._maxConcurrency = maxConcurrency
+	ctx._semaphore = None
+	return ctx
+
+
+async def _resolve(value):
+	# cache handler methods may or may not be coroutines.
+	if inspect.isawaitable(value):
+		return await value
+	return value
+
+
+class _AsyncSingleFlight(object):
+	# The asyncio version of eveapi._SingleFlight. The call is run as a
+	# separate task that all callers wait on, so a caller being cancelled
+	# does not affect the others.
+
+	def __init__(self):
+		self._calls = {}
+
+	async def do(self, key, func, *args):
+		task = self._calls.get(key)
+		if task is None:
+			task = self._calls[key] = asyncio.ensure_future(func(*args))
+			task.add_done_callback(lambda task: self._calls.pop(key, None))
+		return await asyncio.shield(task)
+
+
+class _AsyncConnectionPool(object):
+	# The asyncio version of eveapi._ConnectionPool. Keeps idle keep-alive
+	# (reader, writer) stream pairs per server and speaks just enough
+	# HTTP/1.1 to talk to the API server.
+
+	def __init__(self, size=4, timeout=30):
+		self.size = size
+		self.timeout = timeout
+		self._idle = {}
+
+	async def _connect(self, key):
+		useSSL, address = key
+		if isinstance(address, tuple):
+			host, port = address
+		else:
+			host, sep, port = address.partition(":")
+			port = int(port) if sep else (443 if useSSL else 80)
+		return await asyncio.open_connection(host, int(port), ssl=ssl.create_default_context() if useSSL else None)
+
+	def _acquire(self, key):
+		idle = self._idle.get(key)
+		now = time.time()
+		while idle:
+			reader, writer, since = idle.pop()
+			if now - since < self.timeout and not (reader.at_eof() or writer.is_closing()):
+				return (reader, writer), True
+			writer.close()
+		return None, False
+
+	async def request(self, key, host, method, url, body, headers):
+		# sends the request and reads the response. Returns a tuple of
+		# (status, reason, body). Connections that went stale while idle
+		# are transparently replaced.
+		conn, reused = self._acquire(key)
+		while True:
+			if conn is None:
+				conn = await self._connect(key)
+			try:
+				status, reason, data, keepalive = await self._roundtrip(conn, host, method, url, body, headers)
+				break
+			except (ConnectionError, asyncio.IncompleteReadError, EOFError):
+				conn[1].close()
+				if not reused:
+					raise
+			except:
+				conn[1].close()
+				raise
+			conn, reused = None, False
+
+		if keepalive and self.size > 0:
+			idle = self._idle.setdefault(key, [])
+			idle.append(conn + (time.time(),))
+			if len(idle) > self.size:
+				idle.pop(0)[1].close()
+		else:
+			conn[1].close()
+
+		return status, reason, data
+
+	async def _roundtrip(self, conn, host, method, url, body, headers):
+		reader, writer = conn
+		body = body.encode("utf-8")
+		lines = ["%s %s HTTP/1.1" % (method, url), "Host: %s" % host, "Content-Length: %d" % len(body)]
+		lines.extend("%s: %s" % item for item in headers.items())
+		writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+		await writer.drain()
+
+		line = await reader.readline()
+		if not line:
+			raise EOFError("connection closed by server")
+		version, status, reason = (line.decode("latin-1").rstrip("\r\n").split(None, 2) + [""])[:3]
+
+		respHeaders = {}
+		while True:
+			line = await reader.readline()
+			if line in (b"\r\n", b"\n"):
+				break
+			if not line:
+				raise EOFError("connection closed by server")
+			name, sep, value = line.decode("latin-1").partition(":")
+			respHeaders[name.strip().lower()] = value.strip()
+
+		connection = respHeaders.get("connection", "").lower()
+		keepalive = ("close" not in connection) if version == "HTTP/1.1" else ("keep-alive" in connection)
+
+		if method == "HEAD" or status in ("204", "304"):
+			data = b""
+		elif "chunked" in respHeaders.get("transfer-encoding", "").lower():
+			chunks = []
+			while True:
+				size = int((await reader.readline()).split(b";")[0].strip(), 16)
+				if not size:
+					# skip trailers
+					while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+						pass
+					break
+				chunks.append(await reader.readexactly(size))
+				await reader.readexactly(2)
+			data = b"".join(chunks)
+		elif "content-length" in respHeaders:
+			data = await reader.readexactly(int(respHeaders["content-length"]))
+		else:
+			data = await reader.read()
+			keepalive = False
+
+		return int(status), reason, data, keepalive
+
+	def clear(self):
+		# closes all idle connections.
+		idle, self._idle = self._idle, {}
+		for conns in idle.values():
+			for reader, writer, since in conns:
+				writer.close()
+
+
+class _AsyncRootContext(_RootContext):
+
+	def _requireBlocking(self, feature):
+		raise TypeError("%s is not supported by AsyncEVEAPIConnection" % feature)
+
+	async def __call__(self, path, **kw):
+		path = self._prepare(path, kw)
+		cache = self._root._handler
+
+		if cache:
+			response = await _resolve(cache.retrieve(self._host, path, kw))
+		else:
+			response = None
+
+		if response is None:
+			if not eveapi._useragent:
+				warnings.warn("No User-Agent set! Please use the set_user_agent() module-level function before accessing the EVE API.", stacklevel=2)
+			return await self._fetch(path, kw)
+
+		return await self._process(path, kw, response)
+
+	async def _fetch(self, path, kw):
+		# see eveapi._RootContext._fetch()
+		stale = None
+		if self._staleWhileRevalidate or self._staleIfError:
+			retrieve_stale = getattr(self._handler, "retrieve_stale", None)
+			if retrieve_stale:
+				stale = await _resolve(retrieve_stale(self._host, path, kw))
+
+		if stale is not None and self._staleWhileRevalidate:
+			key = _CacheKey(self._host, path, kw)
+			if key not in self._revalidating:
+				def done(task):
+					self._revalidating.pop(key, None)
+					# background refreshes fail silently, but asyncio
+					# complains if their exception is never retrieved.
+					if not task.cancelled():
+						task.exception()
+				task = self._revalidating[key] = asyncio.ensure_future(self._coalesced(path, kw))
+				task.add_done_callback(done)
+			return await self._process(path, kw, stale)
+
+		try:
+			return await self._coalesced(path, kw)
+		except _serveStaleErrors:
+			if stale is None:
+				raise
+		return await self._process(path, kw, stale)
+
+	async def _coalesced(self, path, kw):
+		if self._flights is None:
+			return await self._process(path, kw, None)
+		return await self._flights.do(_CacheKey(self._host, path, kw), self._process, path, kw, None)
+
+	async def _process(self, path, kw, response):
+		cache = self._root._handler
+
+		store = False
+		if response is None:
+			if self._semaphore is None:
+				self._semaphore = asyncio.Semaphore(self._maxConcurrency)
+
+			key, method, req, body, headers = self._request(path, kw)
+			async with self._semaphore:
+				if self._limiter:
+					wait = self._limiter.reserve(self._host, _KeyID(kw))
+					if wait > 0:
+						await asyncio.sleep(wait)
+				status, reason, response = await self._pool.request(key, self._host, method, req, body, headers)
+
+			if status != 200:
+				_CheckStatus(path, status, reason)
+
+			store = bool(cache)
+
+		# the store call is deferred until after parsing, so that it can be
+		# awaited if the handler's store() is a coroutine.
+		parsed = []
+		try:
+			result = _ParseXML(response, True, store and parsed.append, path, self._root._lazy)
+		except Error as e:
+			retrieve_fallback = cache and getattr(cache, "retrieve_fallback", False)
+			if retrieve_fallback:
+				fallback = await _resolve(retrieve_fallback(self._host, path, kw, reason=e))
+				if fallback is not None:
+					return fallback
+			raise
+
+		if parsed:
+			await _resolve(cache.store(self._host, path, kw, response, parsed[0]))
+
+		return result
+
+	async def _batch(self, calls, workers):
+		# the connection's own concurrency limit applies, so workers is
+		# not needed here.
+		return await asyncio.gather(*[self(path, **kw) for path, kw in calls], return_exceptions=True)
+
+	def close(self):
+		# closes idle connections held by this connection's pool.
+		self._pool.clear()
@@ -35,6 +35,10 @@ setup(
     install_requires=[
         'future>=0.15',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'arrow': ['pyarrow'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'License :: OSI Approved :: MIT License',
@@ -50,5 +54,5 @@ setup(
     ],
     # CONTENTS
     zip_safe=True,
-    py_modules=['eveapi'],
+    py_modules=['eveapi', 'eveapi_async'],
 )
@@ -0,0 +1,68 @@
+import copy
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eveapi
+
+
+class FrozenTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		result = eveapi.Element()
+		result.rs = eveapi.IndexRowset(["id", "name", "value"], [[i, "n%d" % (i % 3), i * 1.5] for i in range(10)], "id")
+		result.plain = eveapi.Rowset(["id", "name"], [[i, "n%d" % (i % 3)] for i in range(10)])
+		filename = os.path.join(self.tmp, "frozen.bin")
+		eveapi.FreezeResult(result, filename)
+		self.frozen = eveapi.OpenFrozen(filename)
+
+	def tearDown(self):
+		del self.frozen
+		shutil.rmtree(self.tmp)
+
+	def check(self, result):
+		self.assertEqual(result.rs.Get(4).name, "n1")
+		self.assertEqual(result.rs.Get(5).value, 7.5)
+		self.assertEqual(list(result.plain.Select("name"))[:3], ["n0", "n1", "n2"])
+
+	def test_repack(self):
+		self.check(eveapi.UnpackResult(eveapi.PackResult(self.frozen)))
+
+	def test_pickle(self):
+		result = pickle.loads(pickle.dumps(self.frozen))
+		self.check(result)
+		result.rs.append([50, "new", 1.0])
+		self.assertEqual(result.rs.Get(50).name, "new")
+
+	def test_deepcopy(self):
+		result = copy.deepcopy(self.frozen)
+		self.check(result)
+		result.plain.append([50, "new"])
+		self.assertEqual(len(result.plain), 11)
+
+
+class PackTest(unittest.TestCase):
+
+	def test_rowset_name(self):
+		result = eveapi.ParseXML("<eveapi version=\"2\"><result><rowset name=\"entries\" key=\"id\" columns=\"id,name\"><row id=\"1\" name=\"a\"/></rowset></result></eveapi>")
+		rs = eveapi.UnpackResult(eveapi.PackResult(result)).entries
+		self.assertEqual(rs._name, "entries")
+		self.assertEqual(rs.Get(1).name, "a")
+
+	def test_tuples(self):
+		result = eveapi.Element()
+		result.pair = (1, ("a", 2))
+		result.items = [1, 2]
+		result = eveapi.UnpackResult(eveapi.PackResult(result))
+		self.assertEqual(result.pair, (1, ("a", 2)))
+		self.assertEqual(result.items, [1, 2])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,59 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eveapi
+
+DOC = b"""<?xml version="1.0" encoding="UTF-8"?>
+<eveapi version="2">
+  <currentTime>2010-01-01 00:00:00</currentTime>
+  <result>
+    <rowset name="entries" key="id" columns="id,name">
+      <row id="1" name="a"/>
+    </rowset>
+  </result>
+  <cachedUntil>2010-01-01 01:00:00</cachedUntil>
+</eveapi>"""
+
+
+class TieredCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		obj = eveapi.ParseXML(DOC)
+		obj.currentTime, obj.cachedUntil = 0, 3600
+		eveapi.TieredCacheHandler(self.directory).store("api", "/char/Test.xml.aspx", {}, DOC, obj)
+		self.filename, = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def retrieve(self):
+		return eveapi.TieredCacheHandler(self.directory).retrieve("api", "/char/Test.xml.aspx", {})
+
+	def damage(self, f):
+		with open(self.filename, "rb") as fh:
+			data = fh.read()
+		with open(self.filename, "wb") as fh:
+			fh.write(f(data))
+
+	def test_disk_hit(self):
+		self.assertEqual(self.retrieve().result.entries.Get(1).name, "a")
+
+	def test_truncated(self):
+		self.damage(lambda data: data[:len(data) // 2])
+		self.assertEqual(self.retrieve(), None)
+		self.assertFalse(os.path.exists(self.filename))
+
+	def test_bad_header(self):
+		self.damage(lambda data: b"x" + data)
+		self.assertEqual(self.retrieve(), None)
+		self.assertFalse(os.path.exists(self.filename))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eveapi
+
+
+class NamedIndexTest(unittest.TestCase):
+
+	def make(self):
+		rs = eveapi.Rowset(["id", "name"], [[5, "e"], [2, "b"], [7, "g"]])
+		rs.AddIndex("id", "id")
+		rs.AddIndex("ordered", "id", ordered=True)
+		return rs
+
+	def test_lookup(self):
+		rs = self.make()
+		self.assertEqual([row.name for row in rs.Lookup("id", 2)], ["b"])
+		self.assertEqual(len(rs.Lookup("id", 3)), 0)
+
+	def test_append_sort_lookup(self):
+		rs = self.make()
+		self.assertEqual(len(rs.Lookup("id", 5)), 1)
+		rs.append([0, "a"])
+		rs.append([3, "c"])
+		rs.SortBy("id", dtype=int)
+		self.assertEqual([row.name for row in rs.Lookup("id", 0)], ["a"])
+		self.assertEqual([row.name for row in rs.Lookup("id", 3)], ["c"])
+		self.assertEqual(len(rs.Lookup("id", 5)), 1)
+		self.assertEqual([row.id for row in rs.Range("ordered", 0, 5)], [0, 2, 3, 5])
+
+	def test_columnar_append_sort_lookup(self):
+		rs = self.make().ToColumnar()
+		rs.AddIndex("id", "id")
+		self.assertEqual(len(rs.Lookup("id", 5)), 1)
+		rs.append([0, "a"])
+		rs.SortBy("id", dtype=int)
+		self.assertEqual([row.name for row in rs.Lookup("id", 0)], ["a"])
+		self.assertEqual(len(rs.Lookup("id", 5)), 1)
+
+
+if __name__ == "__main__":
+	unittest.main()